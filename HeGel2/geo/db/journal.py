@@ -0,0 +1,115 @@
+"""Durable progress journal of extraction runs.
+
+A run extracts the POI of a map in chunks. A chunk is recorded in a local
+sqlite file, by the range of osmids it spans and its size, once its
+documents are flushed to the sink. Entries are keyed by the region, the
+version of the map (Map.version) and the key of the feature plan (the
+extracted fields and how the landmarks are selected), so a restarted run
+skips the chunks it already completed. A new version of the map starts
+from scratch.
+"""
+
+import os
+import sqlite3
+import time
+from typing import Iterable, NamedTuple, Set, Text
+
+import pandas as pd
+
+from HeGel2 import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    region TEXT NOT NULL,
+    map_version TEXT NOT NULL,
+    plan TEXT NOT NULL,
+    first_osmid TEXT NOT NULL,
+    last_osmid TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    completed REAL NOT NULL,
+    PRIMARY KEY (region, map_version, plan, first_osmid, last_osmid, size)
+)
+"""
+
+
+class ChunkRange(NamedTuple):
+    first_osmid: str
+    last_osmid: str
+    size: int
+
+
+def chunk_range(chunk: pd.DataFrame) -> ChunkRange:
+    """
+    Returns the range of a chunk of POI rows: its first and last osmid, in map order, and its size
+    """
+    osmids = chunk["osmid"]
+    return ChunkRange(str(osmids.iloc[0]), str(osmids.iloc[-1]), len(chunk)) if len(chunk) else ChunkRange("", "", 0)
+
+
+class ProgressJournal:
+    """
+    The chunks completed by the runs of one region, map version and feature plan
+    """
+
+    def __init__(
+        self,
+        region: Text,
+        map_version: Text,
+        plan: Text = "*",
+        path: Text = settings.PROGRESS_JOURNAL,
+    ):
+        """
+        Arguments:
+          region: The name of the region of the map.
+          map_version: The version of the map (see Map.version).
+          plan: The key of the feature plan of the runs (see FeaturePlan.key).
+          path: The sqlite file, created if missing.
+        """
+        self.key = (region, map_version, plan)
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute(_SCHEMA)
+
+    def completed(self) -> Set[ChunkRange]:
+        """
+        Returns the chunks completed so far
+        """
+        rows = self._connection.execute(
+            "SELECT first_osmid, last_osmid, size FROM chunks WHERE region = ? AND map_version = ? AND plan = ?",
+            self.key,
+        )
+        return {ChunkRange(*row) for row in rows}
+
+    def mark_completed(self, ranges: Iterable[ChunkRange]) -> None:
+        """
+        Records chunks whose documents are durably written, in one transaction
+        """
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(*self.key, *chunk, now) for chunk in ranges],
+            )
+
+    def reset(self) -> int:
+        """
+        Forgets the completed chunks, so the next run extracts everything again. Returns their number
+        """
+        with self._connection:
+            cursor = self._connection.execute(
+                "DELETE FROM chunks WHERE region = ? AND map_version = ? AND plan = ?", self.key
+            )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __enter__(self) -> "ProgressJournal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,25 +1,130 @@
-from typing import Any, Dict
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Union
 
 import pymongo
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.collection import Collection
 
+from HeGel2 import settings
 from HeGel2.geo.models.get_feature import PoiData
 
-client = pymongo.MongoClient("mongodb://localhost:27017/")
-db = client["hegel"]
-collection = db["TelAviv"]
-collection.create_index("TelAviv")
-
 Document = Dict[str, Any]
 
+_collection: Optional[Collection] = None
 
-def _get_db():
-    pass
+
+class FlushStats(NamedTuple):
+    documents: int
+    upserted: int
+    modified: int
+    matched: int
+    seconds: float
+
+
+def _get_db() -> Collection:
+    """
+    Returns the documents collection, connecting and creating the osmid index on first use
+    """
+    global _collection
+    if _collection is None:
+        client = pymongo.MongoClient(settings.MONGO_URI)
+        _collection = client[settings.MONGO_DATABASE][settings.MONGO_COLLECTION]
+        _collection.create_index("osmid", unique=True)
+    return _collection
 
 
 def save_document():
     pass
 
 
+def _to_document(poi_data: Union[PoiData, Document]) -> Document:
+    if isinstance(poi_data, PoiData):
+        return poi_data.dict(by_alias=True, exclude_unset=True)
+    return poi_data
+
+
 def insert_document(poiData: PoiData) -> None:
-    document = poiData.dict(by_alias=True, exclude_unset=True)
-    collection.insert_one(document)
+    document = _to_document(poiData)
+    _get_db().replace_one({"osmid": document["osmid"]}, document, upsert=True)
+
+
+class DocumentSink:
+    """
+    Buffers documents and writes them as unordered bulk upserts keyed on osmid, so reruns don't duplicate.
+    A flush happens when batch_size documents are buffered or flush_interval seconds passed since the last one.
+    The collection can be any object with a pymongo compatible bulk_write (e.g. an in-process stand-in).
+    With merge=True the fields of the documents are set on the stored ones instead of replacing them,
+    for documents of a subset of the fields
+    """
+
+    def __init__(
+        self,
+        collection: Optional[Collection] = None,
+        batch_size: int = settings.MONGO_BATCH_SIZE,
+        flush_interval: float = settings.MONGO_FLUSH_INTERVAL,
+        merge: bool = False,
+    ):
+        self.collection = collection if collection is not None else _get_db()
+        self.merge = merge
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats: List[FlushStats] = []
+        # The number of documents written to the collection so far.
+        self.flushed = 0
+        self._buffer: List[Document] = []
+        self._last_flush = time.monotonic()
+
+    @property
+    def pending(self) -> int:
+        """
+        The number of buffered documents, not written to the collection yet
+        """
+        return len(self._buffer)
+
+    def write(self, poi_data: Union[PoiData, Document]) -> Optional[FlushStats]:
+        """
+        Buffers a document, returns the flush statistics if the write triggered a flush
+        """
+        self._buffer.append(_to_document(poi_data))
+        if len(self._buffer) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            return self.flush()
+        return None
+
+    def write_many(self, documents: Iterable[Union[PoiData, Document]]) -> List[FlushStats]:
+        stats = [self.write(document) for document in documents]
+        return [flush_stats for flush_stats in stats if flush_stats is not None]
+
+    def flush(self) -> Optional[FlushStats]:
+        """
+        Writes the buffered documents, returns None if the buffer was empty
+        """
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return None
+        documents, self._buffer = self._buffer, []
+        start = time.monotonic()
+        result = self.collection.bulk_write([self._upsert(document) for document in documents], ordered=False)
+        self.flushed += len(documents)
+        flush_stats = FlushStats(
+            documents=len(documents),
+            upserted=result.upserted_count,
+            modified=result.modified_count,
+            matched=result.matched_count,
+            seconds=time.monotonic() - start,
+        )
+        self.stats.append(flush_stats)
+        return flush_stats
+
+    def _upsert(self, document: Document) -> Union[ReplaceOne, UpdateOne]:
+        if self.merge:
+            return UpdateOne({"osmid": document["osmid"]}, {"$set": document}, upsert=True)
+        return ReplaceOne({"osmid": document["osmid"]}, document, upsert=True)
+
+    def close(self) -> Optional[FlushStats]:
+        return self.flush()
+
+    def __enter__(self) -> "DocumentSink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,20 +1,27 @@
-from typing import List, Optional, Tuple
+from functools import cached_property
+from typing import List, Optional, Sequence, Tuple
 
 import geopandas as gpd
-import osmnx as ox
+import numpy as np
 import pandas as pd
-import pyproj
+from pydantic import ValidationError, validate_model
 from shapely.geometry import Point
 from shapely.ops import unary_union
 
 from ... import settings
+from ..map_processor import cells, osm_cache, util
 from ..map_processor.map import Map
-from .utils import get_bearing, polygonizer
+from ..models.get_feature import PoiData
+from .indexes import LandmarkIndex, PolygonIndex, StreetExtentIndex, StreetIndex
+from .plan import POI_DATA_COLUMNS, FeaturePlan
+from .utils import get_bearing
 
 
 def create_neighborhood_json(city: str):
-    city_graph_option1 = ox.geometries_from_place(f"{city}", {"place": "suburb"})[["name", "geometry"]]
-    city_graph_option2 = ox.geometries_from_place(f"{city}", {"boundary": "administrative"})[["name", "geometry"]]
+    city_graph_option1 = osm_cache.geometries_from_place(f"{city}", {"place": "suburb"})[["name", "geometry"]]
+    city_graph_option2 = osm_cache.geometries_from_place(f"{city}", {"boundary": "administrative"})[
+        ["name", "geometry"]
+    ]
 
     concatenated_gpd = pd.concat([city_graph_option2, city_graph_option1], axis=0)
     concatenated_gpd = concatenated_gpd.dropna(subset=["name"]).reset_index()
@@ -33,79 +40,131 @@ def create_neighborhood_json(city: str):
     return neighborhood_gdf
 
 
-def distance_to_point(poi: Point, point: Point) -> int:
+def _partial_poi_data(record: dict) -> PoiData:
+    """
+    Builds a PoiData of only the fields in the record (by alias), validated by the model, the other fields are unset
+    """
+    values, fields_set, error = validate_model(PoiData, record)
+    # The errors of the fields left out of the record (missing required fields) don't apply.
+    errors = [] if error is None else [wrapper for wrapper in error.raw_errors if wrapper.loc_tuple()[0] in record]
+    if errors:
+        raise ValidationError(errors, PoiData)
+    return PoiData.construct(_fields_set=fields_set, **{name: values[name] for name in fields_set})
+
+
+def distance_to_point(poi: Point, point: Point) -> float:
     """
     Calculates the distance between two points
     """
-    _, _, distance = pyproj.Geod(ellps="WGS84").inv(poi.x, poi.y, point.x, point.y)
-    return distance
+    return float(util.geodesic_distances(poi.y, poi.x, point.y, point.x))
 
 
 class GeoFeatures:
+    """
+    The feature extractors of the POI of a map. The indexes are built on first use, so extracting a subset
+    of the fields only builds the indexes of these fields (see plan.FeaturePlan)
+    """
+
     def __init__(self, city, map: Map):
         # Create Map
         self.city = city
         self.map = map
-        self.edges = map.edges.reset_index()
-        self.city_polygons = map.city_polygons
-        self.city_center = unary_union(map.nodes.geometry).centroid
-        self.streets = map.streets
-        self.polygons_is_no_primery, self.polygons_is_primery = self.get_polygons()
+
+    @cached_property
+    def edges(self) -> gpd.GeoDataFrame:
+        return self.map.edges.reset_index()
+
+    @cached_property
+    def street_index(self) -> StreetIndex:
+        return StreetIndex(self.edges)
+
+    @cached_property
+    def node_degrees(self) -> pd.Series:
+        return self.map.get_node_degrees()
+
+    @cached_property
+    def landmark_index(self) -> LandmarkIndex:
+        return LandmarkIndex(self.map.read_poi(LandmarkIndex.COLUMNS), settings.LANDMARKS_DISTANCE)
+
+    @cached_property
+    def city_polygons(self) -> gpd.GeoDataFrame:
+        return self.map.city_polygons
+
+    @cached_property
+    def city_center(self) -> Point:
+        return unary_union(self.map.nodes.geometry).centroid
+
+    @cached_property
+    def streets(self) -> gpd.GeoDataFrame:
+        return self.map.streets
+
+    @cached_property
+    def street_extents(self) -> StreetExtentIndex:
+        return StreetExtentIndex(self.streets)
+
+    @cached_property
+    def polygons_is_no_primery(self) -> gpd.GeoDataFrame:
+        return self.get_polygons()[0]
+
+    @cached_property
+    def polygons_is_primery(self) -> gpd.GeoDataFrame:
+        return self.get_polygons()[1]
+
+    @cached_property
+    def no_primery_index(self) -> PolygonIndex:
+        return PolygonIndex(self.polygons_is_no_primery)
+
+    @cached_property
+    def primery_index(self) -> PolygonIndex:
+        return PolygonIndex(self.polygons_is_primery)
+
+    @cached_property
+    def city_polygons_index(self) -> PolygonIndex:
+        return PolygonIndex(self.city_polygons)
+
+    @cached_property
+    def neighborhood_cells(self) -> cells.CellTable:
+        return self.map.get_neighborhood_cells()
 
     def get_streets(self, osm_id: str) -> List[str]:
         """
         Retrieves the streets of the osm id
         """
-        osm_id = int(osm_id)
-        projection_osmid = self.edges[self.edges["u"] == osm_id]["v"]
-        try:
-            optional_streets = [
-                self.edges[self.edges["u"] == proj_osmid]["name"] for proj_osmid in list(projection_osmid)
-            ]
-            streets = [s.values[0] for s in optional_streets if len(s.values) != 0]
-            print(f"optional_streets: {streets}")
-            streets = list(set(streets))
-            streets = [street for street in streets if street is not None]
-            return streets
-        except BaseException:
-            return None
+        return self.street_index.streets(int(osm_id))
+
+    def get_streets_bulk(self, osm_ids: Sequence[str]) -> List[List[str]]:
+        """
+        Retrieves the streets of many osm ids at once
+        """
+        return self.street_index.streets_bulk(int(osm_id) for osm_id in osm_ids)
 
     def is_poi_in_junction(self, osmid: str) -> bool:
         """
         Checks whether a point of interest (POI) with the given OSM ID (osmid)
         is located within a road junction.
         """
-        valid_osmid = int(osmid)
-        return dict(self.map.nx_graph.degree())[valid_osmid] >= 2
+        return bool(self.is_junction([osmid])[0])
 
-    def _to_polygons(self, streets: pd.DataFrame):
+    def is_junction(self, osmids: Sequence[str]) -> np.ndarray:
         """
-        Converts a Pandas DataFrame of street geometries to a GeoDataFrame of polygons.
+        Vectorized version of is_poi_in_junction, ids missing from the graph are not junctions
         """
-        polygons = polygonizer(streets["geometry"].to_list())
-        sjoin_polygons = gpd.sjoin(polygons, streets, predicate="covers")
-        polygons["names"] = sjoin_polygons.groupby("index").agg(set)["name"]
-        return polygons
+        degrees = self.node_degrees.reindex(np.asarray(osmids, dtype=np.int64), fill_value=0)
+        return degrees.to_numpy() >= 2
 
     def get_polygons(self):
         """
-        Retrieves the polygons corresponding to non-primary and primary streets
-        from the Map's streets DataFrame.
-        """
-        self.streets.dropna(subset="name", inplace=True)
-        self.streets.reset_index(inplace=True)
-        self.streets["type"] = self.streets["name"].apply(lambda x: type(x))
-        streets_no_primery = self.streets[self.streets["type"] != list]
-        streets_no_primery = streets_no_primery[streets_no_primery["geometry"].geom_type == "LineString"]
-        streets_primery = streets_no_primery[
-            streets_no_primery["highway"].isin(
-                ["trunk", "primary", "motorway", "tertiary", "secondary", "footway", "service"]
-            )
-        ]
-        polygons_no_primery, polygons_primery = self._to_polygons(streets_no_primery), self._to_polygons(
-            streets_primery
-        )
-        return polygons_no_primery, polygons_primery
+        Retrieves the polygons corresponding to non-primary and primary streets, computed once per version of the
+        Map's streets and stored with the map (see Map.get_street_blocks).
+        """
+        return self.map.get_street_blocks()
+
+    @staticmethod
+    def _names_at(polygons: gpd.GeoDataFrame, position: Optional[int]) -> Optional[List[str]]:
+        if position is None or position < 0:
+            return None
+        names = polygons["names"].iloc[position]
+        return list(names) if isinstance(names, (set, list)) else None
 
     def get_nearby_streets(self, lon, lat, is_primery) -> Optional[List[str]]:
         """
@@ -113,65 +172,148 @@ class GeoFeatures:
         """
 
         point = Point(float("{:.4f}".format(lon)), float("{:.4f}".format(lat)))
-        print(self.polygons_is_no_primery[self.polygons_is_no_primery.contains(point)]["names"])
-        try:
-            return (
-                list(self.polygons_is_primery[self.polygons_is_primery.contains(point)]["names"].iloc[0])
-                if is_primery
-                else list(self.polygons_is_no_primery[self.polygons_is_no_primery.contains(point)]["names"].iloc[0])
-            )
-        except BaseException:
-            return None
+        index = self.primery_index if is_primery else self.no_primery_index
+        return self._names_at(index.polygons, index.first(point))
+
+    def get_nearby_streets_batch(self, lons: Sequence[float], lats: Sequence[float], is_primery) -> List:
+        """
+        Batch version of get_nearby_streets over arrays of coordinates
+        """
+        lons = np.round(np.asarray(lons, dtype=float), 4)
+        lats = np.round(np.asarray(lats, dtype=float), 4)
+        return self.get_nearby_streets_at(gpd.points_from_xy(lons, lats), is_primery)
+
+    def get_nearby_streets_at(self, points: Sequence[Point], is_primery) -> List:
+        """
+        Batch version of get_nearby_streets over points already rounded to 4 decimals
+        """
+        index = self.primery_index if is_primery else self.no_primery_index
+        return [self._names_at(index.polygons, position) for position in index.first_bulk(points)]
 
     def get_neighborhood(self, poi: Point) -> Optional[str]:
         """
         Returns the neighborhood of the poi
         """
-        neighborhoods_series = self.city_polygons[self.city_polygons.contains(poi)]
-        if neighborhoods_series["name"].any():
-            return neighborhoods_series["name"].iloc[0]
+        return self.get_neighborhood_batch([poi])[0]
+
+    def get_neighborhood_batch(self, points: Sequence[Point]) -> List[Optional[str]]:
+        """
+        Batch version of get_neighborhood over an array of points
+        """
+        points = gpd.GeoSeries(list(points))
+        return self.get_neighborhoods_at(points.x.to_numpy(), points.y.to_numpy())
+
+    def get_neighborhoods_at(self, lons: Sequence[float], lats: Sequence[float]) -> List[Optional[str]]:
+        """
+        Batch version of get_neighborhood over arrays of coordinates.
+        Points in cells inside a neighborhood are resolved by the cell table, only points in boundary cells
+        are tested against the polygons
+        """
+        lons, lats = np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)
+        cellids = util.cellids_from_coords(lats, lons, self.neighborhood_cells.level)
+        return self.get_neighborhoods_at_cells(cellids, lons, lats)
+
+    def get_neighborhoods_at_cells(
+        self, cellids: Sequence[int], lons: Sequence[float], lats: Sequence[float]
+    ) -> List[Optional[str]]:
+        """
+        get_neighborhoods_at with the cell ids of the coordinates (at the level of the cell table) already computed
+        """
+        lons, lats = np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)
+        names = self.city_polygons["name"].to_numpy()
+        positions = self.neighborhood_cells.lookup(cellids)
+        boundary = positions == cells.BOUNDARY
+        if boundary.any():
+            positions[boundary] = self.city_polygons_index.first_bulk(
+                gpd.points_from_xy(lons[boundary], lats[boundary])
+            )
+        return [names[position] if position >= 0 and names[position] else None for position in positions]
 
     def get_relation_in_street(self, osmid: str, point: Point) -> Optional[str]:
         """
         Returns None if no street recognized
         """
-        street_name = self.get_streets(osmid)
-        if street_name:
-            street_name = self.get_streets(osmid)[0]
-            total_bounds: List[int] = self.map.streets[self.map.streets.name == street_name].total_bounds
-            x_first, y_first = total_bounds[:2]
-            x_second, y_second = total_bounds[2:]
-            distance_to_first_bound: int = Point(x_first, y_first).distance(point)
-            distance_to_second_bound: int = Point(x_second, y_second).distance(point)
-            if distance_to_second_bound == distance_to_first_bound == 0:
-                relation = 0
-            else:
-                relation = distance_to_first_bound / (distance_to_first_bound + distance_to_second_bound)
-            return "Start" if relation < 0.4 else "Middle" if relation < 0.6 else "End"
+        return self.get_relations_in_street([osmid], [point.x], [point.y])[0]
+
+    def get_relations_in_street(
+        self, osmids: Sequence[str], lons: Sequence[float], lats: Sequence[float]
+    ) -> List[Optional[str]]:
+        """
+        Batch version of get_relation_in_street over arrays of osm ids and coordinates
+        """
+        return self.get_relations_in_street_at(self.get_streets_bulk(osmids), lons, lats)
+
+    def get_relations_in_street_at(
+        self, street_names: Sequence[List[str]], lons: Sequence[float], lats: Sequence[float]
+    ) -> List[Optional[str]]:
+        """
+        get_relations_in_street with the streets of the POI already retrieved, the relation is to the first one
+        """
+        return self.street_extents.relations([names[0] if names else None for names in street_names], lons, lats)
 
     def get_distance_from_city_center(self, point: Point) -> Tuple[int, str]:
         """
         Calculates the cardinal direction from the city center
         """
 
-        distance = ox.distance.great_circle_vec(self.city_center.x, self.city_center.y, point.x, point.y)
-        bearing = ox.bearing.calculate_bearing(self.city_center.x, self.city_center.y, point.x, point.y)
+        distance = float(util.haversine_distances(self.city_center.y, self.city_center.x, point.y, point.x))
+        bearing = util.great_circle_bearings(self.city_center.y, self.city_center.x, point.y, point.x)
         bearing_relation = get_bearing(bearing)
         return distance, bearing_relation
 
-    def get_top_k_nearest_landmarks(self, point: Point, k: int = 5) -> List[Tuple[str, str, str]]:
+    def get_top_k_nearest_landmarks(
+        self,
+        point: Point,
+        k: int = 5,
+        nearest: bool = True,
+        random_state: Optional[int] = None,
+        osmid: Optional[str] = None,
+    ) -> List[Tuple[str, str, str]]:
         """
-        Returns k nearest landmarks which are in radios of LANDMARKS_DISTANCE from the selected poi
+        Returns k landmarks which are in radios of LANDMARKS_DISTANCE from the selected poi, other than the
+        poi itself (by its osmid).
+        By default the landmarks are the nearest ones, a sample if nearest is False (seeded by random_state)
         """
-        gdf = self.map.poi.to_crs("EPSG:4326")
-        gdf["distance_to_point"] = gdf.apply(lambda row: distance_to_point(point, row["centroid"]), axis=1)
-        in_distance_from_poi_gdf = gdf.loc[gdf["distance_to_point"] < settings.LANDMARKS_DISTANCE]
-        in_distance_from_poi_gdf = in_distance_from_poi_gdf.dropna(subset=["amenity", "name"]).sample(k)
-        bearing_angle_list = list(
-            map(
-                lambda poi: ox.bearing.calculate_bearing(point.x, point.y, poi.x, poi.y),
-                in_distance_from_poi_gdf.centroid,
-            )
+        return self.landmark_index.top_k(point.x, point.y, k, nearest=nearest, random_state=random_state, exclude=osmid)
+
+    def get_top_k_nearest_landmarks_batch(
+        self,
+        points: Sequence[Point],
+        k: int = 5,
+        nearest: bool = True,
+        random_state: Optional[int] = None,
+        osmids: Optional[Sequence[str]] = None,
+    ) -> List[List[Tuple[str, str, str]]]:
+        """
+        Batch version of get_top_k_nearest_landmarks
+        """
+        points = gpd.GeoSeries(np.asarray(points))
+        return self.landmark_index.top_k_bulk(
+            points.x.to_numpy(), points.y.to_numpy(), k, nearest=nearest, random_state=random_state, excludes=osmids
         )
-        bearing_list = list(map(lambda bearing: get_bearing(bearing), bearing_angle_list))
-        return list(zip(in_distance_from_poi_gdf.name, in_distance_from_poi_gdf.amenity, bearing_list))
+
+    def extract_batch(
+        self,
+        poi_gdf: gpd.GeoDataFrame,
+        fields: Optional[Sequence[str]] = None,
+        nearest: bool = True,
+        random_state: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """
+        Extracts the features of a whole POI frame (or a chunk of it) at once.
+        Returns a frame with a column for every field of PoiData (or only the given fields, by alias),
+        indexed like poi_gdf. Only the extractors of these fields, and the indexes they use, are run.
+        The nearby landmarks are the nearest ones by default, a sample if nearest is False (seeded by
+        random_state), see FeaturePlan
+        """
+        return FeaturePlan(fields, nearest, random_state).run(self, poi_gdf)
+
+    @staticmethod
+    def to_poi_data(features: pd.DataFrame) -> List[PoiData]:
+        """
+        Converts the output of extract_batch to PoiData documents.
+        Documents of a subset of the fields are validated by the model and have only these fields set
+        """
+        if set(POI_DATA_COLUMNS).issubset(features.columns):
+            return [PoiData(**record) for record in features.to_dict(orient="records")]
+        return [_partial_poi_data(record) for record in features.to_dict(orient="records")]
@@ -0,0 +1,260 @@
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple, Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point, box
+from shapely.prepared import prep
+
+from ..map_processor import util
+from .utils import get_bearings
+
+# Lower bound on the length of one degree of latitude, so degree boxes always cover the metric radius.
+METERS_PER_DEGREE = 110_000
+
+
+class PolygonIndex:
+    """
+    Point-in-polygon lookups over a fixed set of polygons, backed by a spatial index and prepared geometries
+    """
+
+    def __init__(self, polygons: gpd.GeoDataFrame):
+        self.polygons = polygons
+        self._geometries = gpd.GeoSeries(polygons.geometry.values, crs=polygons.crs)
+        self._sindex = self._geometries.sindex
+        self._prepared = [prep(geometry) for geometry in self._geometries]
+
+    def __len__(self) -> int:
+        return len(self._prepared)
+
+    def query(self, point: Point) -> np.ndarray:
+        """
+        Returns the positions of all polygons containing the point, in frame order
+        """
+        candidates = np.sort(self._sindex.query(point))
+        return np.array([c for c in candidates if self._prepared[c].contains(point)], dtype=np.int64)
+
+    def first(self, point: Point) -> Optional[int]:
+        """
+        Returns the position of the first polygon (in frame order) containing the point
+        """
+        for candidate in np.sort(self._sindex.query(point)):
+            if self._prepared[candidate].contains(point):
+                return int(candidate)
+        return None
+
+    def first_bulk(self, points: gpd.GeoSeries) -> np.ndarray:
+        """
+        Returns for every point the position of the first polygon containing it, or -1
+        """
+        points = gpd.GeoSeries(np.asarray(points), crs=self._geometries.crs)
+        positions = np.full(len(points), len(self), dtype=np.int64)
+        if len(points) and len(self):
+            input_idx, tree_idx = self._sindex.query_bulk(points)
+            geometries = points.values
+            hits = np.fromiter(
+                (self._prepared[t].contains(geometries[i]) for i, t in zip(input_idx, tree_idx)),
+                dtype=bool,
+                count=len(input_idx),
+            )
+            np.minimum.at(positions, input_idx[hits], tree_idx[hits])
+        positions[positions == len(self)] = -1
+        return positions
+
+
+class StreetIndex:
+    """
+    Maps every node id to its neighbours and to the set of street names on the edges leaving it
+    """
+
+    def __init__(self, edges: pd.DataFrame):
+        edges = edges[["u", "v", "name"]]
+        self._neighbours: Dict[int, List[int]] = edges.groupby("u")["v"].agg(lambda v: sorted(set(v))).to_dict()
+        names = edges[["u", "name"]].explode("name").dropna(subset=["name"])
+        self._names: Dict[int, FrozenSet[str]] = names.groupby("u")["name"].agg(frozenset).to_dict()
+
+    def incident_streets(self, osmid: int) -> FrozenSet[str]:
+        """
+        Returns the street names of the edges leaving the node
+        """
+        return self._names.get(osmid, frozenset())
+
+    def streets(self, osmid: int) -> List[str]:
+        """
+        Returns the street names of the node's neighbours, e.g. the streets a POI is projected onto
+        """
+        names = set()
+        for neighbour in self._neighbours.get(osmid, ()):
+            names |= self.incident_streets(neighbour)
+        return sorted(names)
+
+    def streets_bulk(self, osmids: Iterable[int]) -> List[List[str]]:
+        """
+        Batch version of streets
+        """
+        return [self.streets(osmid) for osmid in osmids]
+
+
+class StreetExtentIndex:
+    """
+    The bounds of every street (the union of the bounds of the street rows with exactly that name), for placing
+    points relative to the start and the end of a street
+    """
+
+    def __init__(self, streets: gpd.GeoDataFrame):
+        named = streets[[isinstance(name, str) for name in streets["name"]]]
+        bounds = named.geometry.bounds
+        extents = bounds.groupby(named["name"].to_numpy()).agg(
+            {"minx": "min", "miny": "min", "maxx": "max", "maxy": "max"}
+        )
+        self._names = extents.index
+        self._bounds = extents.to_numpy()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def bounds(self, names: Sequence[Optional[str]]) -> np.ndarray:
+        """
+        Returns the (minx, miny, maxx, maxy) of every street, NaN for unknown names
+        """
+        positions = self._names.get_indexer(pd.Index(names, dtype=object))
+        bounds = np.full((len(positions), 4), np.nan)
+        bounds[positions >= 0] = self._bounds[positions[positions >= 0]]
+        return bounds
+
+    def relations(
+        self, names: Sequence[Optional[str]], xs: Sequence[float], ys: Sequence[float]
+    ) -> List[Optional[str]]:
+        """
+        Returns for every (street, point) whether the point is at the start, the middle or the end of the street,
+        by its relative distance to the two corners of the street bounds. None where the street name is None
+        """
+        xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+        minx, miny, maxx, maxy = self.bounds(names).T
+        to_first = np.sqrt((xs - minx) ** 2 + (ys - miny) ** 2)
+        to_second = np.sqrt((xs - maxx) ** 2 + (ys - maxy) ** 2)
+        # Unknown streets have NaN bounds, whose corners (empty points) are at distance 0: they are at the start.
+        to_first, to_second = np.nan_to_num(to_first), np.nan_to_num(to_second)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relation = np.where((to_first == 0) & (to_second == 0), 0.0, to_first / (to_first + to_second))
+        labels = np.where(relation < 0.4, "Start", np.where(relation < 0.6, "Middle", "End"))
+        return [None if name is None else str(label) for name, label in zip(names, labels)]
+
+
+class LandmarkIndex:
+    """
+    Radius and top-k queries over the centroids of the POIs that have both an amenity and a name
+    """
+
+    # The POI columns the index is built from.
+    COLUMNS = ("osmid", "amenity", "name", "centroid")
+
+    def __init__(self, poi: gpd.GeoDataFrame, radius: float):
+        landmarks = poi.dropna(subset=["amenity", "name"])
+        centroids = gpd.GeoSeries(landmarks["centroid"].values, crs="EPSG:4326")
+        self.radius = radius
+        self.osmids = landmarks["osmid"].astype(str).to_numpy()
+        self.names = landmarks["name"].to_numpy()
+        self.amenities = landmarks["amenity"].to_numpy()
+        self.xs = centroids.x.to_numpy()
+        self.ys = centroids.y.to_numpy()
+        self._centroids = centroids
+        self._sindex = centroids.sindex
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _search_box(self, x: float, y: float):
+        dy = self.radius / METERS_PER_DEGREE
+        dx = dy / max(np.cos(np.radians(min(abs(y) + dy, 89.0))), 1e-6)
+        return box(x - dx, y - dy, x + dx, y + dy)
+
+    def query_radius(self, x: float, y: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the positions of the landmarks closer than the radius to (x, y) and their distances in meters,
+        sorted by distance
+        """
+        candidates = np.sort(self._sindex.query(self._search_box(x, y)))
+        distances = util.geodesic_distances(y, x, self.ys[candidates], self.xs[candidates])
+        in_radius = distances < self.radius
+        candidates, distances = candidates[in_radius], distances[in_radius]
+        order = np.argsort(distances, kind="stable")
+        return candidates[order], distances[order]
+
+    def query_radius_bulk(self, xs: Sequence[float], ys: Sequence[float]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Batch version of query_radius
+        """
+        xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+        if not len(xs):
+            return []
+        boxes = gpd.GeoSeries([self._search_box(x, y) for x, y in zip(xs, ys)], crs=self._centroids.crs)
+        if len(self):
+            input_idx, tree_idx = self._sindex.query_bulk(boxes)
+        else:
+            input_idx, tree_idx = np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        distances = util.geodesic_distances(ys[input_idx], xs[input_idx], self.ys[tree_idx], self.xs[tree_idx])
+        in_radius = distances < self.radius
+        input_idx, tree_idx, distances = input_idx[in_radius], tree_idx[in_radius], distances[in_radius]
+        order = np.lexsort((tree_idx, distances, input_idx))
+        input_idx, tree_idx, distances = input_idx[order], tree_idx[order], distances[order]
+        splits = np.searchsorted(input_idx, np.arange(1, len(xs)))
+        return list(zip(np.split(tree_idx, splits), np.split(distances, splits)))
+
+    def select(
+        self,
+        x: float,
+        y: float,
+        candidates: np.ndarray,
+        k: int,
+        nearest: bool,
+        random_state: Optional[int],
+        exclude: Optional[str] = None,
+    ) -> List[Tuple[str, str, str]]:
+        """
+        Picks k of the candidates, other than the landmark whose osmid is exclude (the POI at (x, y) itself),
+        either the nearest ones or a (optionally seeded) sample, as (name, amenity, cardinal direction from
+        (x, y)) tuples
+        """
+        if exclude is not None:
+            candidates = candidates[self.osmids[candidates] != exclude]
+        k = min(k, len(candidates))
+        if nearest:
+            selected = candidates[:k]
+        else:
+            selected = np.random.RandomState(random_state).choice(candidates, size=k, replace=False)
+        bearings = util.great_circle_bearings(y, x, self.ys[selected], self.xs[selected])
+        return list(zip(self.names[selected], self.amenities[selected], get_bearings(bearings).tolist()))
+
+    def top_k(
+        self,
+        x: float,
+        y: float,
+        k: int,
+        nearest: bool = True,
+        random_state: Optional[int] = None,
+        exclude: Optional[str] = None,
+    ) -> List[Tuple[str, str, str]]:
+        """
+        Returns k landmarks within the radius of (x, y), other than the POI whose osmid is exclude
+        """
+        candidates, _ = self.query_radius(x, y)
+        return self.select(x, y, candidates, k, nearest, random_state, exclude)
+
+    def top_k_bulk(
+        self,
+        xs: Sequence[float],
+        ys: Sequence[float],
+        k: int,
+        nearest: bool = True,
+        random_state: Union[int, None] = None,
+        excludes: Optional[Sequence[str]] = None,
+    ) -> List[List[Tuple[str, str, str]]]:
+        """
+        Batch version of top_k, excludes holds the osmid to exclude for every point
+        """
+        excludes = excludes if excludes is not None else [None] * len(xs)
+        return [
+            self.select(x, y, candidates, k, nearest, random_state, exclude)
+            for x, y, exclude, (candidates, _) in zip(xs, ys, excludes, self.query_radius_bulk(xs, ys))
+        ]
@@ -0,0 +1,210 @@
+"""Declarative feature plan of GeoFeatures.extract_batch.
+
+Every output field of PoiData (by alias) and every intermediate shared by
+several fields (the centroids, their coordinates, the rounded points, the S2
+cell ids, ...) is a Step: the steps it reads and the GeoFeatures indexes it
+uses. A FeaturePlan for a subset of the fields runs only the steps these
+fields depend on, each once per batch, so an unselected feature costs
+nothing, not even the building of its index. Steps can also read the
+parameters of the plan (e.g. how the landmarks are selected) as inputs.
+"""
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Text, Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from ..map_processor import util
+from ..models.get_feature import PoiData
+from .utils import get_bearings
+
+POI_DATA_COLUMNS = [field.alias for field in PoiData.__fields__.values()]
+
+
+def _first_truthy(poi_gdf: pd.DataFrame, columns: List[str]) -> np.ndarray:
+    """
+    Row-wise `a or b or ...` over the given columns, missing columns are treated as None
+    """
+    values = np.full(len(poi_gdf), None, dtype=object)
+    pending = np.ones(len(poi_gdf), dtype=bool)
+    for column in columns:
+        if column not in poi_gdf.columns:
+            continue
+        column_values = poi_gdf[column].to_numpy(dtype=object)
+        values[pending] = column_values[pending]
+        pending &= ~np.fromiter(map(bool, column_values), dtype=bool, count=len(column_values))
+    return values
+
+
+class Step(NamedTuple):
+    """
+    A value computed once per batch, as compute(features, poi_gdf, *values of the inputs)
+    """
+
+    inputs: Tuple[Text, ...]
+    compute: Callable[..., Any]
+    # The GeoFeatures attributes (lazily built indexes) compute reads.
+    indexes: Tuple[Text, ...] = ()
+
+
+def _coords(features, poi_gdf, centroids):
+    return centroids.x.to_numpy(), centroids.y.to_numpy()
+
+
+def _rounded_points(features, poi_gdf, coords):
+    xs, ys = coords
+    return gpd.points_from_xy(np.round(xs, 4), np.round(ys, 4))
+
+
+def _center_distances(features, poi_gdf, coords):
+    xs, ys = coords
+    return util.haversine_distances(features.city_center.y, features.city_center.x, ys, xs)
+
+
+def _center_bearings(features, poi_gdf, coords):
+    xs, ys = coords
+    return util.great_circle_bearings(features.city_center.y, features.city_center.x, ys, xs)
+
+
+STEPS: Dict[Text, Step] = {
+    # Intermediates.
+    "centroids": Step((), lambda features, poi_gdf: gpd.GeoSeries(poi_gdf["centroid"].values)),
+    "coords": Step(("centroids",), _coords),
+    "osmids": Step((), lambda features, poi_gdf: poi_gdf["osmid"].astype(str).tolist()),
+    "rounded_points": Step(("coords",), _rounded_points),
+    "cellids": Step(
+        ("coords",),
+        lambda features, poi_gdf, coords: util.cellids_from_coords(
+            coords[1], coords[0], features.neighborhood_cells.level
+        ),
+        ("neighborhood_cells",),
+    ),
+    "center_distances": Step(("coords",), _center_distances, ("city_center",)),
+    "center_bearings": Step(("coords",), _center_bearings, ("city_center",)),
+    # The fields of PoiData.
+    "osmid": Step(("osmids",), lambda features, poi_gdf, osmids: osmids),
+    "name": Step((), lambda features, poi_gdf: _first_truthy(poi_gdf, ["name", "wikipedia"])),
+    "amenity": Step(
+        (), lambda features, poi_gdf: _first_truthy(poi_gdf, ["amenity", "tourism", "building", "description"])
+    ),
+    "location": Step(
+        ("coords",),
+        lambda features, poi_gdf, coords: [{"type": "Point", "coordinates": [x, y]} for x, y in zip(*coords)],
+    ),
+    "street_names": Step(
+        ("osmids",), lambda features, poi_gdf, osmids: features.get_streets_bulk(osmids), ("street_index",)
+    ),
+    "is_junction": Step(("osmids",), lambda features, poi_gdf, osmids: features.is_junction(osmids), ("node_degrees",)),
+    "nearby_to_non_primery_streets": Step(
+        ("rounded_points",),
+        lambda features, poi_gdf, points: features.get_nearby_streets_at(points, is_primery=False),
+        ("no_primery_index",),
+    ),
+    "nearby_to_primery_streets": Step(
+        ("rounded_points",),
+        lambda features, poi_gdf, points: features.get_nearby_streets_at(points, is_primery=True),
+        ("primery_index",),
+    ),
+    "relation_in_street": Step(
+        ("street_names", "coords"),
+        lambda features, poi_gdf, street_names, coords: features.get_relations_in_street_at(street_names, *coords),
+        ("street_extents",),
+    ),
+    "neighbourhood": Step(
+        ("cellids", "coords"),
+        lambda features, poi_gdf, cellids, coords: features.get_neighborhoods_at_cells(cellids, *coords),
+        ("city_polygons", "city_polygons_index"),
+    ),
+    "cardinal_direction_to_city_center": Step(
+        ("center_bearings",), lambda features, poi_gdf, bearings: get_bearings(bearings)
+    ),
+    "distance_from_city_center": Step(("center_distances",), lambda features, poi_gdf, distances: distances),
+    "nearby_landmarks": Step(
+        ("coords", "osmids", "landmarks_nearest", "landmarks_random_state"),
+        lambda features, poi_gdf, coords, osmids, nearest, random_state: features.landmark_index.top_k_bulk(
+            *coords, 5, nearest=nearest, random_state=random_state, excludes=osmids
+        ),
+        ("landmark_index",),
+    ),
+}
+
+# The inputs of the steps set by the FeaturePlan instead of computed.
+PARAMETERS = ("landmarks_nearest", "landmarks_random_state")
+
+
+def _dependency_order(fields: Sequence[Text]) -> List[Text]:
+    """The steps the fields depend on (the fields included), every step after its inputs"""
+    order: List[Text] = []
+    visiting = set()
+
+    def visit(name: Text):
+        if name in order or name in PARAMETERS:
+            return
+        assert name not in visiting, f"The feature plan has a cycle through {name}"
+        visiting.add(name)
+        for input_name in STEPS[name].inputs:
+            visit(input_name)
+        visiting.discard(name)
+        order.append(name)
+
+    for field in fields:
+        visit(field)
+    return order
+
+
+class FeaturePlan:
+    """
+    The steps of a subset of the PoiData fields, in dependency order
+    """
+
+    def __init__(
+        self, fields: Optional[Sequence[Text]] = None, nearest: bool = True, random_state: Optional[int] = None
+    ):
+        """
+        Arguments:
+          fields: The aliases of the PoiData fields to extract, all of them if None.
+          nearest: Whether the nearby landmarks are the nearest ones, else they are sampled.
+          random_state: The seed of the landmark sample when nearest is False. None samples differently
+          on every run, so only nearest=True or a seed give the same output for the same map.
+        """
+        requested = set(POI_DATA_COLUMNS if fields is None else fields)
+        unknown = requested.difference(POI_DATA_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown fields {sorted(unknown)}, the fields are {POI_DATA_COLUMNS}")
+        self.fields = [field for field in POI_DATA_COLUMNS if field in requested]
+        self.order = _dependency_order(self.fields)
+        self.indexes = list(dict.fromkeys(index for name in self.order for index in STEPS[name].indexes))
+        self.parameters = {"landmarks_nearest": nearest, "landmarks_random_state": random_state}
+
+    @property
+    def key(self) -> Text:
+        """
+        Identifies the output of the plan: its fields and, when the landmarks are extracted, how they are selected
+        """
+        fields = "*" if self.fields == POI_DATA_COLUMNS else ",".join(self.fields)
+        if "nearby_landmarks" not in self.fields:
+            return fields
+        if self.parameters["landmarks_nearest"]:
+            return f"{fields};landmarks=nearest"
+        return f"{fields};landmarks=sample:{self.parameters['landmarks_random_state']}"
+
+    def prepare(self, features) -> None:
+        """
+        Builds the indexes of the plan, e.g. before forking workers that share them
+        """
+        for index in self.indexes:
+            getattr(features, index)
+
+    def run(self, features, poi_gdf: gpd.GeoDataFrame) -> pd.DataFrame:
+        """
+        Returns a frame with a column for every field of the plan (in PoiData order), indexed like poi_gdf
+        """
+        values: Dict[Text, Any] = dict(self.parameters)
+        for name in self.order:
+            step = STEPS[name]
+            values[name] = step.compute(features, poi_gdf, *(values[input_name] for input_name in step.inputs))
+        result = pd.DataFrame(index=poi_gdf.index)
+        for field in self.fields:
+            result[field] = values[field]
+        return result
@@ -1,9 +1,9 @@
 from math import atan2, degrees
 from typing import List, Optional, Tuple
 
-import geopandas as gpd
 import numpy as np
-import shapely
+
+from ..map_processor.blocks import polygonizer
 
 
 def flatten_list(streets: List[Tuple[Optional[str], List[str]]]) -> List[str]:
@@ -17,14 +17,6 @@ def flatten_list(streets: List[Tuple[Optional[str], List[str]]]) -> List[str]:
     return list(set(valid_streets))
 
 
-def polygonizer(lines):
-    merged_lines = shapely.ops.linemerge(lines)
-    border_lines = shapely.ops.unary_union(merged_lines)
-    decomposition = shapely.ops.polygonize(border_lines)
-    polygons = gpd.GeoDataFrame(decomposition, columns=["geometry"])
-    return polygons.reset_index()
-
-
 def azimuth_to_street(point, street):
     angles = 0
     for l in street.boundary.geoms:
@@ -36,16 +28,24 @@ def azimuth_to_street(point, street):
     return int(np.round(azimuth))
 
 
+CARDINAL_DIRECTIONS = np.array(["northeast", "southeast", "southwest", "northwest"])
+
+
+def get_bearings(bearings: np.ndarray) -> np.ndarray:
+    """
+    Returns the cardinal directions of an array of bearing angles in degrees.
+    """
+    bearings = np.asarray(bearings, dtype=float)
+    quadrant = np.select(
+        [(0 <= bearings) & (bearings <= 90), (90 < bearings) & (bearings <= 180), (180 < bearings) & (bearings <= 270)],
+        [0, 1, 2],
+        default=3,
+    )
+    return CARDINAL_DIRECTIONS[quadrant]
+
+
 def get_bearing(bearing: int) -> str:
     """
     Returns the cardinal direction of a given bearing angle in degrees.
     """
-    if 0 <= bearing <= 90:
-        location = "northeast"
-    elif 90 < bearing <= 180:
-        location = "southeast"
-    elif 180 < bearing <= 270:
-        location = "southwest"
-    else:
-        location = "northwest"
-    return location
+    return str(get_bearings(bearing))
@@ -0,0 +1,69 @@
+"""Street blocks: the polygons enclosed by the streets of a map, with the names of the streets around them.
+
+Blocks are built for the named streets (non-primary) and for the subset of
+them with a primary highway type. Polygonizing the streets is the slowest
+part of feature extraction startup, so the blocks are stored in the map
+bundle when it is built or written (see Map.write_map), for the version of
+the streets layer they were computed from.
+"""
+
+from typing import Tuple
+
+import geopandas as gpd
+import pandas as pd
+from shapely.ops import linemerge, polygonize, unary_union
+
+PRIMARY_HIGHWAYS = ["trunk", "primary", "motorway", "tertiary", "secondary", "footway", "service"]
+
+
+def polygonizer(lines):
+    merged_lines = linemerge(lines)
+    border_lines = unary_union(merged_lines)
+    decomposition = polygonize(border_lines)
+    polygons = gpd.GeoDataFrame(decomposition, columns=["geometry"])
+    return polygons.reset_index()
+
+
+def _blocks(streets: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    The polygons enclosed by the streets, with the set of names of the streets covering them
+    """
+    polygons = polygonizer(streets["geometry"].to_list())
+    sjoin_polygons = gpd.sjoin(polygons, streets, predicate="covers")
+    polygons["names"] = sjoin_polygons.groupby("index")["name"].agg(set)
+    return polygons
+
+
+def street_blocks(streets: gpd.GeoDataFrame) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """
+    Computes the blocks of the non-primary and primary streets, without changing the streets frame.
+    Arguments:
+      streets: The streets of the map, as ox.graph_to_gdfs returns the edges.
+    Returns:
+      The non-primary and the primary blocks, with a names column (a set of street names, NaN for blocks
+      that no street covers).
+    """
+    named = streets.dropna(subset=["name"]).reset_index()
+    # Streets with several names (a list) are left out.
+    named = named[[not isinstance(name, list) for name in named["name"]]]
+    streets_no_primery = named[named["geometry"].geom_type == "LineString"]
+    streets_primery = streets_no_primery[streets_no_primery["highway"].isin(PRIMARY_HIGHWAYS)]
+    return _blocks(streets_no_primery), _blocks(streets_primery)
+
+
+def to_frame(blocks_no_primery: gpd.GeoDataFrame, blocks_primery: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    Stacks both kinds of blocks into one layer frame, with a primary column
+    """
+    frame = pd.concat([blocks_no_primery.assign(primary=False), blocks_primery.assign(primary=True)], ignore_index=True)
+    frame["names"] = frame["names"].where(frame["names"].notna(), None)
+    return gpd.GeoDataFrame(frame, geometry="geometry", crs=blocks_no_primery.crs)
+
+
+def from_frame(frame: gpd.GeoDataFrame) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """
+    Splits a layer frame written by to_frame back into the non-primary and primary blocks
+    """
+    primary = frame["primary"].to_numpy(dtype=bool)
+    frame = frame.drop(columns=["primary"])
+    return frame[~primary].reset_index(drop=True), frame[primary].reset_index(drop=True)
@@ -0,0 +1,309 @@
+"""Versioned, columnar on-disk format of a Map.
+
+A bundle is a directory holding one file per layer (poi, streets, nodes,
+edges, ...) and a JSON manifest describing them. Large, wide layers are
+stored as GeoParquet so they can be read (or streamed) with column
+projection and predicate pushdown, graph arrays and derived tables as
+uncompressed Feather so they can be memory mapped.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Text, Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from shapely.geometry.base import BaseGeometry
+
+BUNDLE_VERSION = 1
+MANIFEST_ENDING = "_manifest.json"
+PARQUET = ".parquet"
+FEATHER = ".feather"
+# Parquet layers are written in row groups of this size, the unit of predicate pushdown and of streaming reads.
+ROW_GROUP_SIZE = 65536
+ROW_NUMBER = "__row_number"
+
+Manifest = Dict[Text, Any]
+LayerEntry = Dict[Text, Any]
+# Row filters in the DNF format of pyarrow.parquet, e.g. [("amenity", "not in", ["bench"])]. A row whose
+# filtered column is null never matches, for every operator (pyarrow alone keeps them for "not in").
+Filters = List[Any]
+
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def _to_arrow_safe(frame: pd.DataFrame, crs) -> Tuple[pd.DataFrame, Sequence[Text]]:
+    """Converts Python-object columns to types Arrow can store.
+    Geometries become geometry columns, containers are JSON encoded and
+    columns mixing scalar types are stored as strings.
+    Returns:
+      The converted frame and the names of the JSON encoded columns.
+    """
+    frame = frame.copy()
+    json_columns = []
+    for name in frame.columns:
+        column = frame[name]
+        if column.dtype != object:
+            continue
+        types = set(map(type, column.dropna()))
+        if types and all(issubclass(value_type, BaseGeometry) for value_type in types):
+            frame[name] = gpd.GeoSeries(column, crs=crs)
+        elif types & {list, tuple, set, frozenset, dict}:
+            frame[name] = column.map(
+                lambda value: None if value is None else json.dumps(value, default=_json_default, ensure_ascii=False)
+            )
+            json_columns.append(name)
+        elif len(types) > 1:
+            frame[name] = column.map(lambda value: value if pd.isnull(value) else str(value))
+    return frame, json_columns
+
+
+def file_digest(path: Text) -> Text:
+    """Returns the SHA-1 of the file content."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as layer_file:
+        for block in iter(lambda: layer_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def layer_digest(dir_name: Text, entry: LayerEntry) -> Text:
+    """Returns the digest of a layer file, from its manifest entry or (for older bundles) from the file."""
+    return entry.get("digest") or file_digest(os.path.join(dir_name, entry["file"]))
+
+
+def write_layer(frame: pd.DataFrame, path: Text) -> LayerEntry:
+    """Writes a layer as GeoParquet or Feather, depending on the file ending.
+    Arguments:
+      frame: The (Geo)DataFrame to write.
+      path: The path of the file.
+    Returns:
+      The manifest entry of the layer.
+    """
+    crs = frame.crs if isinstance(frame, gpd.GeoDataFrame) else None
+    index = [name for name in frame.index.names if name is not None]
+    index_in_columns = [name for name in index if name in frame.columns]
+    if index:
+        frame = frame.reset_index(level=[name for name in index if name not in index_in_columns])
+    frame = frame.reset_index(drop=True)
+
+    frame, json_columns = _to_arrow_safe(frame, crs)
+    geometry_columns = [name for name in frame.columns if str(frame[name].dtype) == "geometry"]
+    if geometry_columns:
+        geometry = frame.geometry.name if isinstance(frame, gpd.GeoDataFrame) else geometry_columns[0]
+        frame = gpd.GeoDataFrame(frame, geometry=geometry, crs=crs)
+
+    # Written next to the file and moved over it, so readers (and memory maps) never see a partial layer.
+    tmp_path = path + ".tmp"
+    if path.endswith(PARQUET):
+        if geometry_columns:
+            frame.to_parquet(tmp_path, index=False, row_group_size=ROW_GROUP_SIZE)
+        else:
+            pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), tmp_path, row_group_size=ROW_GROUP_SIZE)
+    else:
+        if geometry_columns:
+            frame.to_feather(tmp_path, index=False, compression="uncompressed")
+        else:
+            feather.write_feather(frame, tmp_path, compression="uncompressed")
+    digest = file_digest(tmp_path)
+    os.replace(tmp_path, path)
+
+    return {
+        "file": os.path.basename(path),
+        "digest": digest,
+        "rows": len(frame),
+        "columns": list(frame.columns),
+        "geometry_columns": geometry_columns,
+        "json_columns": json_columns,
+        "index": index,
+        "index_in_columns": index_in_columns,
+    }
+
+
+def _read_columns(entry: LayerEntry, columns: Optional[Sequence[Text]]) -> Optional[List[Text]]:
+    return None if columns is None else [name for name in entry["columns"] if name in set(columns)]
+
+
+def _dataset(path: Text) -> ds.Dataset:
+    return ds.dataset(path, format="parquet" if path.endswith(PARQUET) else "feather")
+
+
+def _filter_columns(filters: Filters) -> List[Text]:
+    conjunctions = filters if isinstance(filters[0], list) else [filters]
+    return sorted({name for conjunction in conjunctions for name, _, _ in conjunction})
+
+
+def _filter_expression(filters: Filters) -> ds.Expression:
+    """The pyarrow expression of the filters, with every filtered column of a conjunction required to be valid."""
+    conjunctions = filters if isinstance(filters[0], list) else [filters]
+    expression = None
+    for conjunction in conjunctions:
+        term = pq.filters_to_expression([conjunction])
+        for name in sorted({name for name, _, _ in conjunction}):
+            term = term & ds.field(name).is_valid()
+        expression = term if expression is None else expression | term
+    return expression
+
+
+def _from_arrow(table: pa.Table, geo: Dict[Text, Any]) -> pd.DataFrame:
+    """Converts an Arrow table to a frame, decoding the WKB geometry columns listed in the GeoParquet metadata."""
+    frame = table.to_pandas()
+    geometry_columns = [name for name in geo.get("columns", {}) if name in frame.columns]
+    if not geometry_columns:
+        return frame
+    for name in geometry_columns:
+        frame[name] = gpd.GeoSeries.from_wkb(frame[name], crs=geo["columns"][name].get("crs"))
+    primary = geo["primary_column"] if geo.get("primary_column") in geometry_columns else geometry_columns[0]
+    return gpd.GeoDataFrame(frame, geometry=primary)
+
+
+def _geo_metadata(schema: pa.Schema) -> Dict[Text, Any]:
+    metadata = schema.metadata or {}
+    return json.loads(metadata[b"geo"]) if b"geo" in metadata else {}
+
+
+def _restore(frame: pd.DataFrame, entry: LayerEntry) -> pd.DataFrame:
+    """Decodes the JSON columns and restores the index of a layer frame."""
+    for name in entry["json_columns"]:
+        if name in frame.columns:
+            frame[name] = frame[name].map(lambda value: value if value is None else json.loads(value))
+
+    index = entry["index"]
+    if index and all(name in frame.columns for name in index):
+        frame = frame.set_index(index, drop=False)
+        frame = frame.drop(columns=[name for name in index if name not in entry["index_in_columns"]])
+    return frame
+
+
+def read_layer(
+    dir_name: Text,
+    entry: LayerEntry,
+    columns: Optional[Sequence[Text]] = None,
+    memory_map: bool = True,
+    filters: Optional[Filters] = None,
+) -> pd.DataFrame:
+    """Reads a layer written by write_layer.
+    Arguments:
+      dir_name: The directory of the bundle.
+      entry: The manifest entry of the layer.
+      columns: Only read these columns (all columns if None). The index is
+      only restored when all of its columns are read.
+      memory_map: Memory map the file instead of reading it into memory.
+      filters: Only read the rows that match these filters, pushed down to
+      the row groups of the file.
+    Returns:
+      A GeoDataFrame if any geometry column is read, else a DataFrame.
+    """
+    path = os.path.join(dir_name, entry["file"])
+    read_columns = _read_columns(entry, columns)
+    geometry_columns = entry["geometry_columns"] if read_columns is None else (
+        [name for name in entry["geometry_columns"] if name in read_columns]
+    )
+
+    if filters:
+        dataset = _dataset(path)
+        table = dataset.to_table(columns=read_columns, filter=_filter_expression(filters))
+        frame = _from_arrow(table, _geo_metadata(dataset.schema))
+    elif path.endswith(PARQUET):
+        if geometry_columns:
+            frame = gpd.read_parquet(path, columns=read_columns, memory_map=memory_map)
+        else:
+            frame = pq.read_table(path, columns=read_columns, memory_map=memory_map).to_pandas()
+    else:
+        if geometry_columns:
+            frame = gpd.read_feather(path, columns=read_columns, memory_map=memory_map)
+        else:
+            frame = feather.read_table(path, columns=read_columns, memory_map=memory_map).to_pandas()
+    return _restore(frame, entry)
+
+
+def iter_layer(
+    dir_name: Text,
+    entry: LayerEntry,
+    batch_size: int,
+    columns: Optional[Sequence[Text]] = None,
+    filters: Optional[Filters] = None,
+) -> Iterator[pd.DataFrame]:
+    """Streams a layer written by write_layer, holding about one row group in memory at a time.
+    Arguments:
+      dir_name: The directory of the bundle.
+      entry: The manifest entry of the layer.
+      batch_size: The number of rows per frame (the last frame may be smaller).
+      columns: Only read these columns (all columns if None).
+      filters: Only read the rows that match these filters, pushed down to
+      the row groups of the file.
+    Yields:
+      Frames of the layer, in file order, as read_layer returns them.
+    """
+    dataset = _dataset(os.path.join(dir_name, entry["file"]))
+    geo = _geo_metadata(dataset.schema)
+    batches = dataset.to_batches(
+        columns=_read_columns(entry, columns),
+        filter=_filter_expression(filters) if filters else None,
+        batch_size=batch_size,
+    )
+
+    # The scanner yields batches of at most batch_size rows (fewer after filtering), regrouped to exactly batch_size.
+    pending, rows = [], 0
+    for batch in batches:
+        pending.append(batch)
+        rows += batch.num_rows
+        if rows < batch_size:
+            continue
+        table = pa.Table.from_batches(pending)
+        full = rows - rows % batch_size
+        for start in range(0, full, batch_size):
+            yield _restore(_from_arrow(table.slice(start, batch_size), geo), entry)
+        rest = table.slice(full)
+        pending, rows = rest.to_batches(), rest.num_rows
+    if rows:
+        yield _restore(_from_arrow(pa.Table.from_batches(pending), geo), entry)
+
+
+def filter_mask(frame: pd.DataFrame, filters: Filters) -> np.ndarray:
+    """Evaluates filters on an in-memory frame, with the same semantics as when reading a layer.
+    Returns:
+      A boolean mask of the matching rows.
+    """
+    names = _filter_columns(filters)
+    table = pa.Table.from_pandas(frame[names].assign(**{ROW_NUMBER: np.arange(len(frame))}), preserve_index=False)
+    matching = ds.dataset(table).to_table(columns=[ROW_NUMBER], filter=_filter_expression(filters))
+    mask = np.zeros(len(frame), dtype=bool)
+    mask[matching[ROW_NUMBER].to_numpy()] = True
+    return mask
+
+
+def manifest_path(dir_name: Text, map_name: Text) -> Text:
+    return os.path.join(dir_name, map_name.lower() + MANIFEST_ENDING)
+
+
+def read_manifest(dir_name: Text, map_name: Text) -> Optional[Manifest]:
+    """Returns the manifest of the bundle, or None if the directory holds no bundle of the map."""
+    path = manifest_path(dir_name, map_name)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+    assert manifest["version"] <= BUNDLE_VERSION, f"Unsupported map bundle version {manifest['version']} in {path}."
+    return manifest
+
+
+def write_manifest(dir_name: Text, manifest: Manifest):
+    """Writes the manifest atomically, so readers never see a partial bundle description."""
+    path = manifest_path(dir_name, manifest["map_name"])
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,114 @@
+"""Precomputed S2 cell to polygon table.
+
+The polygons (e.g. neighbourhoods) are covered with S2Cells of one level.
+A cell that lies inside a polygon, and intersects no polygon before it,
+resolves every point in it with a single hash lookup. Only the cells on a
+polygon boundary need an exact point-in-polygon test, and cells outside the
+coverings are inside no polygon.
+"""
+
+import hashlib
+from typing import Iterator, Sequence, Text
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Polygon, box
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import prep
+
+from HeGel2.geo.map_processor import util
+
+# Positions returned by CellTable.lookup for cells that are not inside a single polygon.
+OUTSIDE = -1
+BOUNDARY = -2
+
+# Cell boundaries are buffered by this much (degrees, about 1cm), so cells whose curved edges
+# run along a polygon edge are never taken as inside it.
+CELL_TOLERANCE = 1e-7
+
+
+def _polygon_parts(geometry: BaseGeometry) -> Iterator[Polygon]:
+    if geometry is None or geometry.is_empty:
+        return
+    for part in getattr(geometry, "geoms", [geometry]):
+        if isinstance(part, Polygon):
+            yield part
+
+
+def _covering(polygons: Sequence[BaseGeometry], level: int) -> np.ndarray:
+    cellids = set()
+    for geometry in polygons:
+        for part in _polygon_parts(geometry):
+            # Parts that don't convert to an S2Polygon are covered by their bounding box.
+            covering = util.s2cellids_from_polygon(part, level) or util.s2cellids_from_polygon(box(*part.bounds), level)
+            cellids.update(cell.id() for cell in covering)
+    # S2CellIds are uint64, the table stores them as int64 like cellids_from_coords.
+    return np.array(sorted(cellids), dtype=np.uint64).view(np.int64)
+
+
+def polygons_digest(polygons: Sequence[BaseGeometry]) -> Text:
+    """Returns the SHA-1 of the polygons (their WKB, in order), the table positions are only valid for these."""
+    digest = hashlib.sha1()
+    for geometry in polygons:
+        digest.update(b"" if geometry is None else geometry.wkb)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CellTable:
+    """Maps the S2CellIds of one level to the position of the polygon containing them, OUTSIDE or BOUNDARY."""
+
+    def __init__(self, cellids: np.ndarray, positions: np.ndarray, level: int):
+        self.cellids = cellids
+        self.positions = positions
+        self.level = level
+        self._index = pd.Index(cellids)
+
+    @classmethod
+    def from_polygons(cls, polygons: gpd.GeoSeries, level: int) -> "CellTable":
+        """Builds the table from the cells covering the polygons.
+        Arguments:
+          polygons: The polygons, in lng-lat. Points in several polygons resolve to the first one,
+          as PolygonIndex.first does. Other geometries are ignored.
+          level: The S2Cell level of the table.
+        """
+        # Geometries without a polygon contain no point, they are left out of the intersection tests.
+        polygons = gpd.GeoSeries([geometry if any(_polygon_parts(geometry)) else None for geometry in polygons])
+        cellids = _covering(polygons, level)
+        lats, lngs = util.cell_boundaries_from_cellids(cellids)
+        cells = gpd.GeoSeries([Polygon(zip(x, y)) for x, y in zip(lngs, lats)]).buffer(CELL_TOLERANCE)
+
+        # The first polygon intersecting each cell decides it: inside if it contains the whole cell.
+        first = np.full(len(cells), len(polygons), dtype=np.int64)
+        if len(cells) and len(polygons):
+            cell_idx, polygon_idx = polygons.sindex.query_bulk(cells, predicate="intersects")
+            np.minimum.at(first, cell_idx, polygon_idx)
+        intersecting = first < len(polygons)
+        prepared = {position: prep(polygons.iloc[position]) for position in np.unique(first[intersecting])}
+        inside = np.array(
+            [hit and prepared[position].contains(cell) for hit, position, cell in zip(intersecting, first, cells)],
+            dtype=bool,
+        )
+        positions = np.where(inside, first, BOUNDARY).astype(np.int32)
+        return cls(cellids[intersecting], positions[intersecting], level)
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame, level: int) -> "CellTable":
+        return cls(frame["cellid"].to_numpy(dtype=np.int64), frame["position"].to_numpy(dtype=np.int32), level)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({"cellid": self.cellids, "position": self.positions})
+
+    def __len__(self) -> int:
+        return len(self.cellids)
+
+    def lookup(self, cellids: Sequence[int]) -> np.ndarray:
+        """Returns for every cell id (of the table level) the position of the polygon containing the
+        whole cell, OUTSIDE if no polygon intersects it, or BOUNDARY if its points need an exact test."""
+        cellids = np.asarray(cellids, dtype=np.int64)
+        if not len(self):
+            return np.full(len(cellids), OUTSIDE, dtype=np.int64)
+        found = self._index.get_indexer(cellids)
+        return np.where(found >= 0, self.positions[found], OUTSIDE).astype(np.int64)
+
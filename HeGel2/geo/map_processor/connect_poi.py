@@ -1,16 +1,243 @@
 import itertools
+import multiprocessing
 
 import geopandas as gpd
 import numpy as np
 import pandas as pd
 import rtree
-from shapely.geometry import LineString, MultiPoint
+from shapely.geometry import LineString, MultiPoint, Point
 from shapely.ops import snap, split
 
 pd.options.mode.chained_assignment = None
 
+# highway tags of the nodes and edges added by connect_poi
+NODE_HIGHWAY_PP = "projected_pap"  # POI Access Point
+NODE_HIGHWAY_POI = "poi"
+EDGE_HIGHWAY = "projected_footway"
+# first osmid of the projected points (PPs)
+OSMID_PREFIX = 9990000000
+METER_EPSG = 3857
 
-def connect_poi(pois, nodes, edges, key_col=None, path=None, threshold=200, knn=5, meter_epsg=3857):
+
+def _line_segments(lines):
+    """Explode LineStrings into their straight segments.
+
+    Returns:
+        indptr (ndarray): segments of line i are indptr[i]:indptr[i + 1]
+        starts, ends (ndarray): (n_segments, 2) start and end coordinates
+        bounds (ndarray): (n_lines, 4) minx, miny, maxx, maxy of every line
+    """
+    coords = [np.asarray(line.coords)[:, :2] for line in lines]
+    sizes = np.array([len(c) for c in coords], dtype=np.int64)
+    assert sizes.min() > 1, "Lines need at least two coordinates."
+    indptr = np.concatenate([[0], np.cumsum(sizes - 1)])
+    xy = np.concatenate(coords)
+    offsets = np.cumsum(sizes) - sizes
+    bounds = np.hstack([np.minimum.reduceat(xy, offsets), np.maximum.reduceat(xy, offsets)])
+    is_start = np.ones(len(xy), dtype=bool)
+    is_start[offsets + sizes - 1] = False
+    start_idx = np.flatnonzero(is_start)
+    return indptr, xy[start_idx], xy[start_idx + 1], bounds
+
+
+def _project(xy, segments, point_idx, line_idx):
+    """Exact distance and projected point (as line.interpolate(line.project(point)))
+    for every (point, line) pair, computed over all segments of the lines at once."""
+    indptr, starts, ends, _ = segments
+    counts = indptr[line_idx + 1] - indptr[line_idx]
+    pair = np.repeat(np.arange(len(point_idx)), counts)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    seg = np.repeat(indptr[line_idx], counts) + np.arange(counts.sum()) - first
+
+    p = xy[point_idx[pair]]
+    a, ab = starts[seg], ends[seg] - starts[seg]
+    length2 = np.einsum("ij,ij->i", ab, ab)
+    t = np.einsum("ij,ij->i", p - a, ab) / np.where(length2 > 0, length2, 1)
+    q = a + np.clip(t, 0, 1)[:, None] * ab
+    dist = np.hypot(*(p - q).T)
+
+    # the nearest segment of each pair, the first one along the line on ties
+    nearest = _first_of_groups(np.lexsort((seg, dist, pair)), pair)
+    distances = np.full(len(point_idx), np.inf)
+    points = np.full((len(point_idx), 2), np.nan)
+    distances[pair[nearest]] = dist[nearest]
+    points[pair[nearest]] = q[nearest]
+    return distances, points
+
+
+def _first_of_groups(order, groups):
+    """Keep the first position of every group in 'order' (sorted by group first)."""
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = groups[order][1:] != groups[order][:-1]
+    return order[keep]
+
+
+def _pairs(candidates):
+    """Flatten per-point candidate lists into (point, line) index arrays."""
+    candidates = list(candidates)
+    point_idx = np.repeat(np.arange(len(candidates)), [len(c) for c in candidates])
+    line_idx = np.fromiter(itertools.chain.from_iterable(candidates), dtype=np.int64, count=len(point_idx))
+    return point_idx, line_idx
+
+
+def _subset_segments(segments, positions):
+    """The segments of the lines at 'positions' (sorted), as a segments tuple of their own."""
+    indptr, starts, ends, bounds = segments
+    counts = indptr[positions + 1] - indptr[positions]
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    seg = np.repeat(indptr[positions], counts) + np.arange(counts.sum()) - first
+    return np.concatenate([[0], np.cumsum(counts)]), starts[seg], ends[seg], bounds[positions]
+
+
+def _nearest(xy, segments, knn):
+    """nearest_lines over point coordinates and exploded line segments."""
+    # seed: knn nearest bounding boxes
+    tree = rtree.index.Index((i, tuple(bounds), None) for i, bounds in enumerate(segments[3]))
+    seeds = [list(tree.nearest((x, y, x, y), knn)) for x, y in xy]
+    point_idx, line_idx = _pairs(seeds)
+    seed_distances, _ = _project(xy, segments, point_idx, line_idx)
+    radius = np.full(len(xy), np.inf)
+    np.minimum.at(radius, point_idx, seed_distances)
+    radius = radius * (1 + 1e-9) + 1e-9  # float slack, the box may only grow
+
+    # expand: every line within the radius has a bounding box intersecting the radius box
+    point_idx, line_idx = _pairs(list(tree.intersection((x - r, y - r, x + r, y + r))) for (x, y), r in zip(xy, radius))
+    distances, projected = _project(xy, segments, point_idx, line_idx)
+
+    best = _first_of_groups(np.lexsort((line_idx, distances, point_idx)), point_idx)
+    return line_idx[best], distances[best], projected[best]
+
+
+def _points_xy(points):
+    return np.array([(point.x, point.y) for point in points]).reshape(-1, 2)
+
+
+def nearest_lines(points, lines, knn=5):
+    """Find the nearest line of every point, exactly and in bulk.
+
+    Candidates are seeded with the knn nearest bounding boxes (rtree) and then
+    expanded with a box query of the best seed distance, so no line closer than
+    the seed can be missed. Ties are broken by the lowest line position.
+
+    Args:
+        points (GeoSeries): points (geom: Point)
+        lines (GeoSeries): lines in the same crs (geom: LineString)
+        knn (int): number of bounding-box neighbours to seed the search with
+
+    Returns:
+        positions (ndarray): position of the nearest line in 'lines'
+        distances (ndarray): distance to the nearest line
+        projected (ndarray): (n, 2) coordinates of the projected point (PP)
+    """
+    assert len(lines), "No lines to project on."
+    return _nearest(_points_xy(points), _line_segments(lines), knn)
+
+
+def split_line(task):
+    """Split 'line' by all intersecting 'pps' (as multipoint), given as a (line, pps) task.
+
+    Returns:
+        new_lines (list): a list of all line segments after the split
+    """
+    line, pps = task
+    # IMPORTANT FIX for ensuring intersection between splitters and the line
+    # but no need for updating edges_meter manually because the old lines will be
+    # replaced anyway
+    line = snap(line, pps, 1e-8)  # slow?
+
+    try:
+        new_lines = list(split(line, pps))  # split into segments
+        return new_lines
+    except TypeError as e:
+        print("Error when splitting line: {}\n{}\n{}\n".format(e, line, pps))
+        return []
+
+
+# The points and segments of a tiled projection, inherited by the forked workers.
+_TILES = None
+
+
+def _nearest_in_tile(task):
+    points, lines = task
+    xy, segments, knn = _TILES
+    positions, distances, projected = _nearest(xy[points], _subset_segments(segments, lines), knn)
+    return lines[positions], distances, projected
+
+
+def _map(function, tasks, processes):
+    """map() in a pool of 'processes' forked workers, in order; in-process for a single worker or task."""
+    if processes is None or processes <= 1 or len(tasks) <= 1:
+        return list(map(function, tasks))
+    with multiprocessing.get_context("fork").Pool(min(processes, len(tasks))) as pool:
+        return pool.map(function, tasks, chunksize=1)
+
+
+def nearest_lines_tiled(points, lines, knn=5, tile_size=2000, buffer=200, processes=None):
+    """nearest_lines over a grid of tiles, in a process pool.
+
+    The points are grouped into square tiles, and each tile searches only the
+    lines whose bounding box is within 'buffer' of it. A tile result no further
+    than 'buffer' is exact (any closer line would be within the buffer); the
+    other points are searched again over all lines. The output is identical to
+    nearest_lines.
+
+    Args:
+        points (GeoSeries): points (geom: Point)
+        lines (GeoSeries): lines in the same (metric) crs (geom: LineString)
+        knn (int): number of bounding-box neighbours to seed the search with
+        tile_size (float): the side of a tile, in crs units
+        buffer (float): the margin of lines around each tile, in crs units
+        processes (int): number of worker processes, None or 1 for in-process
+
+    Returns:
+        The same (positions, distances, projected) as nearest_lines.
+    """
+    global _TILES
+    assert len(lines), "No lines to project on."
+    xy = _points_xy(points)
+    segments = _line_segments(lines)
+    bounds = segments[3]
+
+    origin = xy.min(axis=0) if len(xy) else np.zeros(2)
+    cells = np.floor((xy - origin) / tile_size).astype(np.int64)
+    tile_keys, tile_of_point = np.unique(cells, axis=0, return_inverse=True)
+    tasks = []
+    for tile, key in enumerate(tile_keys):
+        minx, miny = origin + key * tile_size - buffer
+        maxx, maxy = origin + (key + 1) * tile_size + buffer
+        near = (bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx) & (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny)
+        if near.any():
+            tasks.append((np.flatnonzero(tile_of_point == tile), np.flatnonzero(near)))
+
+    positions = np.full(len(xy), -1, dtype=np.int64)
+    distances = np.full(len(xy), np.inf)
+    projected = np.full((len(xy), 2), np.nan)
+    _TILES = (xy, segments, knn)
+    try:
+        for (tile_points, _), result in zip(tasks, _map(_nearest_in_tile, tasks, processes)):
+            positions[tile_points], distances[tile_points], projected[tile_points] = result
+    finally:
+        _TILES = None
+
+    fallback = np.flatnonzero(~(distances <= buffer))
+    if len(fallback):
+        positions[fallback], distances[fallback], projected[fallback] = _nearest(xy[fallback], segments, knn)
+    return positions, distances, projected
+
+
+def connect_poi(
+    pois,
+    nodes,
+    edges,
+    key_col=None,
+    path=None,
+    threshold=200,
+    knn=5,
+    meter_epsg=METER_EPSG,
+    processes=None,
+    tile_size=2000,
+    osmid_start=OSMID_PREFIX,
+):
     """Connect and integrate a set of POIs into an existing road network.
 
     Given a road network in the form of two GeoDataFrames: nodes and edges,
@@ -36,11 +263,19 @@ def connect_poi(pois, nodes, edges, key_col=None, path=None, threshold=200, knn=
                          connection edge beyond this length will be removed.
                          The unit is in meters as crs epsg is set to 3857 by
                          default during processing.
-        knn (int): k nearest neighbors to query for the nearest edge.
-                   Consider increasing this number up to 10 if the connection
-                   output is slightly unreasonable. But higher knn number will
-                   slow down the process.
+        knn (int): k nearest neighbors (by bounding box) to seed the nearest
+                   edge search with. The result is the exact nearest edge for
+                   any knn; a larger knn only tightens the follow-up box query.
         meter_epsg (int): preferred EPSG in meter units. Suggested 3857 or 3395.
+        processes (int): number of worker processes for the projection and split
+                         stages. POIs are projected per spatial tile (with a
+                         'threshold' margin) and the results stitched back in
+                         order, so the output is identical to the serial path.
+        tile_size (int): the side of a projection tile, in meters.
+        osmid_start (int): the osmid of the first projected point, the others
+                           follow consecutively. Pass one past the largest
+                           existing PP id when connecting into a network that
+                           already has PPs.
 
     Returns:
         nodes (GeoDataFrame): the original gdf with POIs and PPs appended
@@ -55,39 +290,7 @@ def connect_poi(pois, nodes, edges, key_col=None, path=None, threshold=200, knn=
 
     # STAGE 0: initialization
     # 0-1: helper functions
-    def find_kne(point, lines):
-        # Finds the index of the closet line
-        dists = np.array(list(map(lambda l: l.distance(point), lines)))
-        kne_pos = dists.argsort()[0]
-        kne = lines.iloc[[kne_pos]]
-        kne_idx = kne.index[0]
-        return kne_idx, kne.values[0]
-
-    def get_pp(point, line):
-        """Get the projected point (pp) of 'point' on 'line'."""
-        # project new Point to be interpolated
-        pp = line.interpolate(line.project(point))  # PP as a Point
-        return pp
-
-    def split_line(line, pps):
-        """Split 'line' by all intersecting 'pps' (as multipoint).
-
-        Returns:
-            new_lines (list): a list of all line segments after the split
-        """
-        # IMPORTANT FIX for ensuring intersection between splitters and the line
-        # but no need for updating edges_meter manually because the old lines will be
-        # replaced anyway
-        line = snap(line, pps, 1e-8)  # slow?
-
-        try:
-            new_lines = list(split(line, pps))  # split into segments
-            return new_lines
-        except TypeError as e:
-            print("Error when splitting line: {}\n{}\n{}\n".format(e, line, pps))
-            return []
-
-    def update_nodes(nodes, new_points, ptype, meter_epsg=3857):
+    def update_nodes(nodes, new_points, ptype, meter_epsg=METER_EPSG):
         """Update nodes with a list (pp) or a GeoDataFrame (poi) of new_points.
 
         Args:
@@ -149,7 +352,7 @@ def connect_poi(pois, nodes, edges, key_col=None, path=None, threshold=200, knn=
             new_edges["highway"] = edge_highway
 
         # update features (a bit slow)
-        new_edges["length"] = [l.length for l in new_lines]
+        new_edges["length"] = gpd.GeoSeries(list(new_lines)).length.to_numpy()
         new_edges["u"] = new_edges["geometry"].map(lambda x: nodes_id_dict.get(list(x.coords)[0], None))
         new_edges["v"] = new_edges["geometry"].map(lambda x: nodes_id_dict.get(list(x.coords)[-1], None))
         new_edges["osmid"] = ["_".join(list(map(str, s))) for s in zip(new_edges["u"], new_edges["v"])]
@@ -180,10 +383,10 @@ def connect_poi(pois, nodes, edges, key_col=None, path=None, threshold=200, knn=
 
     # 0-2: configurations
     # set poi arguments
-    node_highway_pp = "projected_pap"  # POI Access Point
-    node_highway_poi = "poi"
-    edge_highway = "projected_footway"
-    osmid_prefix = 9990000000
+    node_highway_pp = NODE_HIGHWAY_PP
+    node_highway_poi = NODE_HIGHWAY_POI
+    edge_highway = EDGE_HIGHWAY
+    osmid_prefix = osmid_start
 
     # convert CRS
 
@@ -195,11 +398,6 @@ def connect_poi(pois, nodes, edges, key_col=None, path=None, threshold=200, knn=
     nodes_meter = nodes.to_crs(epsg=meter_epsg)
     edges_meter = edges.to_crs(epsg=meter_epsg)
 
-    # build rtree
-    print("Building rtree...")
-    Rtree = rtree.index.Index()
-    [Rtree.insert(fid, geom.bounds) for fid, geom in edges_meter["geometry"].iteritems()]
-
     # STAGE 1: interpolation
     # 1-1: update external nodes (pois)
     print("Updating external nodes...")
@@ -208,18 +406,15 @@ def connect_poi(pois, nodes, edges, key_col=None, path=None, threshold=200, knn=
     # 1-2: update internal nodes (interpolated pps)
     # locate nearest edge (kne) and projected point (pp)
     print("Projecting POIs to the network...")
-    pois_meter["near_idx"] = [list(Rtree.nearest(point.bounds, 7)) for point in pois_meter["geometry"]]  # slow
-    pois_meter["near_lines"] = [edges_meter["geometry"][near_idx] for near_idx in pois_meter["near_idx"]]  # very slow
-
-    samples = [s.sample() for s in pois_meter["near_lines"]]
-    pois_meter["kne_idx"] = [ind.index[0] for ind in samples]
-    knes = [ind.values[0] for ind in samples]
-
-    pois_meter["pp"] = [get_pp(point, kne) for point, kne in zip(pois_meter["geometry"], knes)]
+    kne_pos, _, pps = nearest_lines_tiled(
+        pois_meter["geometry"], edges_meter["geometry"], knn, tile_size, buffer=threshold, processes=processes
+    )
+    pois_meter["kne_idx"] = edges_meter.index[kne_pos]
+    pois_meter["pp"] = [Point(x, y) for x, y in pps]
 
     # update nodes
     print("Updating internal nodes...")
-    nodes_meter, _ = update_nodes(nodes_meter, list(pois_meter["pp"]), ptype="pp", meter_epsg=meter_epsg)
+    nodes_meter, pps_gdf = update_nodes(nodes_meter, list(pois_meter["pp"]), ptype="pp", meter_epsg=meter_epsg)
     nodes_coord = nodes_meter["geometry"].map(lambda x: x.coords[0])
     nodes_id_dict = dict(zip(nodes_coord, nodes_meter["osmid"].astype("Int64")))
 
@@ -227,14 +422,15 @@ def connect_poi(pois, nodes, edges, key_col=None, path=None, threshold=200, knn=
     print("Updating internal edges...")
     # split
     line_pps_dict = {k: MultiPoint(list(v)) for k, v in pois_meter.groupby(["kne_idx"])["pp"]}
-    new_lines = [split_line(edges_meter["geometry"][idx], pps) for idx, pps in line_pps_dict.items()]  # bit slow
+    tasks = [(edges_meter["geometry"][idx], pps) for idx, pps in line_pps_dict.items()]
+    new_lines = _map(split_line, tasks, processes)  # bit slow
     edges_meter, _ = update_edges(edges_meter, new_lines, replace=True)
 
     # STAGE 2: connection
     # 2-1: update external edges (projected footways connected to pois)
     # establish new_edges
     print("Updating external links...")
-    pps_gdf = nodes_meter[nodes_meter["highway"] == node_highway_pp]
+    # (only the PPs of this call; the network may already hold PPs of earlier POIs)
     new_lines = [LineString([p1, p2]) for p1, p2 in zip(pois_meter["geometry"], pps_gdf["geometry"])]
     edges_meter, _ = update_edges(edges_meter, new_lines, replace=False)
 
@@ -258,8 +454,8 @@ def connect_poi(pois, nodes, edges, key_col=None, path=None, threshold=200, knn=
         print("Nodes count:", len(nodes_meter))
         print("Node coordinates key count:", len(nodes_id_dict))
     # - examine missing nodes
-    print("Missing 'from' nodes:", len(edges[edges["u"] is None]))
-    print("Missing 'to' nodes:", len(edges[edges["v"] is None]))
+    print("Missing 'from' nodes:", edges["u"].isnull().sum())
+    print("Missing 'to' nodes:", edges["v"].isnull().sum())
 
     # save and return
     if path:
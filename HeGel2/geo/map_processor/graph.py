@@ -0,0 +1,145 @@
+"""Compact, read-only representation of the map graph.
+
+Nodes are addressed by int32 positions into a sorted array of osmids and
+the undirected adjacency is stored in CSR form (indptr/indices), with
+the edge attributes kept as typed columns. Degree and neighbour queries
+are array lookups instead of walks over networkx attribute dicts.
+"""
+
+from typing import FrozenSet, Optional, Sequence, Text
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from HeGel2.geo.map_processor import bundle
+
+EDGE_COLUMNS = ("name", "highway", "length")
+
+
+def _hashable(value):
+    return tuple(value) if isinstance(value, (list, np.ndarray)) else value
+
+
+class CompactGraph:
+    """Undirected multigraph with the same edge identity as Map.nx_graph:
+    an edge is (u, v, key) regardless of direction, and an edge without a
+    key is always distinct."""
+
+    def __init__(self, node_ids: np.ndarray, indptr: np.ndarray, indices: np.ndarray, slots: np.ndarray, edges):
+        self.node_ids = node_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.slots = slots
+        self.edges = edges
+
+    @classmethod
+    def from_frames(cls, nodes: pd.DataFrame, edges: pd.DataFrame, edge_columns: Sequence[Text] = EDGE_COLUMNS):
+        """Builds the graph from the node and edge frames of a Map.
+        Arguments:
+          nodes: A frame with an osmid column or index.
+          edges: A frame with u, v and (optionally) key columns or index levels.
+          edge_columns: The edge attributes to keep.
+        """
+        node_osmids = nodes["osmid"] if "osmid" in nodes.columns else nodes.index.to_series()
+        edges = edges.reset_index() if "u" not in edges.columns else edges
+        u = edges["u"].to_numpy(dtype=np.int64)
+        v = edges["v"].to_numpy(dtype=np.int64)
+        if "key" in edges.columns:
+            key = pd.to_numeric(edges["key"], errors="coerce").to_numpy(dtype=float, copy=True)
+        else:
+            key = np.zeros(len(edges))
+        missing_key = np.isnan(key)
+        key[missing_key] = -1 - np.arange(missing_key.sum())
+
+        # networkx keeps one edge per undirected (u, v, key), with the attributes of its last occurrence.
+        identity = pd.DataFrame({"a": np.minimum(u, v), "b": np.maximum(u, v), "key": key})
+        keep = ~identity.duplicated(keep="last").to_numpy()
+
+        columns = [column for column in edge_columns if column in edges.columns]
+        typed = {}
+        for column in columns:
+            values = edges[column].to_numpy()[keep]
+            if pd.api.types.is_numeric_dtype(edges[column]):
+                typed[column] = values
+            else:
+                typed[column] = pd.Categorical([_hashable(value) for value in values])
+
+        node_ids = np.unique(np.concatenate([node_osmids.to_numpy(dtype=np.int64), u, v]))
+        u_pos = np.searchsorted(node_ids, u[keep]).astype(np.int32)
+        v_pos = np.searchsorted(node_ids, v[keep]).astype(np.int32)
+        edge_frame = pd.DataFrame({"u": u_pos, "v": v_pos, "key": key[keep], **typed})
+
+        edge_ids = np.arange(len(edge_frame), dtype=np.int32)
+        sources = np.concatenate([u_pos, v_pos])
+        order = np.argsort(sources, kind="stable")
+        indices = np.concatenate([v_pos, u_pos])[order]
+        slots = np.concatenate([edge_ids, edge_ids])[order]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=len(node_ids)))]).astype(np.int64)
+        return cls(node_ids, indptr, indices, slots, edge_frame)
+
+    @classmethod
+    def from_bundle(cls, dir_name: Text, map_name: Text, edge_columns: Sequence[Text] = EDGE_COLUMNS):
+        """Builds the graph straight from the node and edge files of a saved map bundle."""
+        manifest = bundle.read_manifest(dir_name, map_name)
+        assert manifest is not None, f"No map bundle of {map_name} in {dir_name}."
+        nodes = bundle.read_layer(dir_name, manifest["layers"]["nodes"], ["osmid"])
+        edges = bundle.read_layer(dir_name, manifest["layers"]["edges"], ["u", "v", "key", *edge_columns])
+        return cls.from_frames(nodes, edges, edge_columns)
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def positions(self, osmids: Sequence[int]) -> np.ndarray:
+        """Returns the positions of the osmids, -1 for ids that are not in the graph."""
+        osmids = np.asarray(osmids, dtype=np.int64)
+        if not len(self.node_ids):
+            return np.full(len(osmids), -1, dtype=np.int32)
+        positions = np.minimum(np.searchsorted(self.node_ids, osmids), len(self.node_ids) - 1)
+        return np.where(self.node_ids[positions] == osmids, positions, -1).astype(np.int32)
+
+    def degree(self, osmids: Sequence[int]) -> np.ndarray:
+        """Returns the (networkx) degree of the nodes, 0 for ids that are not in the graph."""
+        positions = self.positions(osmids)
+        degrees = self.indptr[positions + 1] - self.indptr[positions]
+        return np.where(positions >= 0, degrees, 0)
+
+    def degrees(self) -> pd.Series:
+        """Returns the degree of every node, keyed by osmid."""
+        return pd.Series(np.diff(self.indptr).astype(np.int32), index=pd.Index(self.node_ids, name="osmid"))
+
+    def _slots(self, osmid: int) -> Optional[slice]:
+        position = self.positions([osmid])[0]
+        if position < 0:
+            return None
+        return slice(self.indptr[position], self.indptr[position + 1])
+
+    def neighbors(self, osmid: int) -> np.ndarray:
+        """Returns the osmids of the node's neighbours."""
+        slots = self._slots(osmid)
+        if slots is None:
+            return np.array([], dtype=np.int64)
+        return self.node_ids[np.unique(self.indices[slots])]
+
+    def incident_streets(self, osmid: int) -> FrozenSet[Text]:
+        """Returns the street names of the edges incident to the node."""
+        slots = self._slots(osmid)
+        if slots is None or "name" not in self.edges.columns:
+            return frozenset()
+        names = set()
+        for name in self.edges["name"].iloc[self.slots[slots]].dropna():
+            names.update(name if isinstance(name, tuple) else (name,))
+        return frozenset(names)
+
+    def to_networkx(self) -> nx.MultiGraph:
+        """Returns a networkx MultiGraph with the kept edge attributes."""
+        graph = nx.MultiGraph()
+        graph.add_nodes_from(self.node_ids.tolist())
+        attributes = self.edges.drop(columns=["u", "v", "key"]).astype(object)
+        attributes = attributes.where(attributes.notna(), None).to_dict("records")
+        keys = [int(key) if key >= 0 else None for key in self.edges["key"]]
+        graph.add_edges_from(
+            (int(u), int(v), key, data)
+            for u, v, key, data in zip(self.node_ids[self.edges["u"]], self.node_ids[self.edges["v"]], keys, attributes)
+        )
+        return graph
@@ -1,35 +1,116 @@
+import contextlib
 import copy
+import gc
+import hashlib
 import logging
 import os
 from pathlib import Path
-from typing import Optional, Text, Tuple
+from typing import Dict, Iterator, List, Optional, Sequence, Text, Tuple
 
 import geopandas as gpd
 import networkx as nx
+import numpy as np
 import osmnx as ox
 import pandas as pd
 from geopandas import GeoSeries
 from shapely.geometry import LineString, Point
 
-from HeGel2.geo.map_processor import connect_poi, osm, regions, util
+from HeGel2 import settings
+from HeGel2.geo.map_processor import blocks, bundle, connect_poi, osm, osm_cache, osm_extract, regions, util
+from HeGel2.geo.map_processor.cells import CellTable, polygons_digest
+from HeGel2.geo.map_processor.graph import CompactGraph
 
 LARGE_AREAS = 0.0001
+# The layers a map is built of, the other layers of a bundle (degrees, neighborhood_cells, street_blocks) are derived.
+SOURCE_LAYERS = ["poi", "streets", "nodes", "edges"]
 NEIGHBORHOODS_LIBRARY = "/Users/itaimondshine/PycharmProjects/NLP/HeGel2/HeGel2/HeGel2/geo/extractors/city_polygons/"
 
 
+def _edge_identities(edges: pd.DataFrame) -> List[Tuple]:
+    """Returns the (u, v, key) of every edge as stored in an undirected MultiGraph, None for edges without a key
+    (these are always distinct)."""
+    return [
+        (min(u, v), max(u, v), key) if pd.notnull(key) else None
+        for u, v, key in zip(edges["u"].tolist(), edges["v"].tolist(), edges["key"].tolist())
+    ]
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Disables the cyclic garbage collector inside the block, restoring its previous state."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _column_records(frame: pd.DataFrame, exclude: Sequence[Text] = ()) -> List[Dict]:
+    """Returns the rows of the frame as attribute dicts, built column by column.
+    Arguments:
+      frame: The frame to convert.
+      exclude: Columns to leave out of the dicts.
+    Returns:
+      One dict per row, with native Python values.
+    """
+    exclude = set(exclude)
+    columns = [column for column in frame.columns if column not in exclude]
+    # Geometry arrays box every element on iteration; their backing object array holds the same geometries.
+    values = [
+        frame[column].to_numpy().tolist() if str(frame[column].dtype) == "geometry" else frame[column].tolist()
+        for column in columns
+    ]
+    return [dict(zip(columns, row)) for row in zip(*values)] if columns else [{} for _ in range(len(frame))]
+
+
+class _Lazy:
+    """A Map attribute read by the map's _read_<name> method on first access, and cached.
+    Assigning None drops the cached value, so it is read again on the next access.
+    """
+
+    def __set_name__(self, owner, name: Text):
+        self.name = name
+        self.attribute = "_" + name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.__dict__.get(self.attribute)
+        if value is None:
+            value = getattr(instance, "_read_" + self.name)()
+            instance.__dict__[self.attribute] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.attribute] = value
+
+
 class Map:
-    def __init__(self, region: regions.Region, level: int = 18, load_directory: Text = None):
-        self.osmnx_graph = ox.graph_from_polygon(region.polygon, network_type="all")
-        self.city_polygons = gpd.read_file(f'{Path(NEIGHBORHOODS_LIBRARY).joinpath("Tel_Aviv")}_neighborhoods.geojson')
-        self.polygon_area = region.polygon
-        self.map_name = region.name
-        self.region = region
-        self.level = level
-        self.polygon_area = region.polygon
-        self.load_directory = load_directory
-        self.nx_graph = None
-        self.nodes = None
-        self.edges = None
+    # Read from the map bundle (or downloaded) on first access, so loading a map only reads its manifest.
+    poi = _Lazy()
+    streets = _Lazy()
+    nodes = _Lazy()
+    edges = _Lazy()
+    nx_graph = _Lazy()
+    osmnx_graph = _Lazy()
+    osm_geometries = _Lazy()
+    city_polygons = _Lazy()
+
+    def __init__(
+        self, region: regions.Region, level: int = 18, load_directory: Text = None, osm_file: Optional[Text] = None
+    ):
+        """
+        Arguments:
+          region: The region of the map.
+          level: The S2Cell level.
+          load_directory: The directory of a saved map, loaded instead of building the map if not empty.
+          Its layers are read on first access.
+          osm_file: A local OSM extract (.osm, .osm.bz2 or .osm.pbf) to build the map from, instead of
+          downloading the region from Overpass.
+        """
+        self._set_region(region, level, load_directory, osm_file)
 
         if load_directory and len(os.listdir(self.load_directory)) != 0:
             print("Loading map from directory.")
@@ -39,9 +120,151 @@ class Map:
             self.poi, self.streets = self.get_poi()
             self.build_graph()
             print("Graph Built successfully.")
-            self.write_map(load_directory)
+            self.write_map(load_directory, write_neighborhood_cells=True, write_street_blocks=True)
             print("Graph Saved successfully.")
 
+    def _set_region(self, region: regions.Region, level: int, load_directory: Optional[Text], osm_file: Optional[Text]):
+        self.osm_file = osm_file
+        self.map_name = region.name
+        self.region = region
+        self.level = level
+        self.polygon_area = region.polygon
+        self.load_directory = load_directory
+        self.node_degrees = None
+        self.neighborhood_cells = None
+        self.street_blocks = None
+        self.compact_graph = None
+        self._bundle_dir = None
+        self._manifest = None
+        self._columns = {}
+
+    @classmethod
+    def open(cls, dir_name: Text, region: regions.Region, columns: Optional[Dict[Text, Sequence[Text]]] = None):
+        """Open a saved map without reading any of its layers, only the manifest of the bundle.
+        Arguments:
+          dir_name: The directory of the map bundle.
+          region: The region of the map.
+          columns: Optional column projection per layer, applied when the layer is read.
+        Returns:
+          The map, with its layers (and the graph built from them) read on first access.
+        """
+        manifest = bundle.read_manifest(dir_name, region.name)
+        assert manifest is not None, f"No map bundle of {region.name} in {dir_name}."
+        map = cls.__new__(cls)
+        map._set_region(region, manifest["level"], dir_name, None)
+        map.load_map(dir_name, columns)
+        return map
+
+    def available_layers(self) -> Dict[Text, int]:
+        """Returns the layers of the bundle the map was loaded from and their number of rows, without reading them."""
+        if self._manifest is None:
+            return {}
+        return {name: entry["rows"] for name, entry in self._manifest["layers"].items()}
+
+    def version(self) -> Optional[Text]:
+        """Returns a digest of the source layers of the bundle the map was loaded from (or last written to),
+        which changes whenever one of them is rewritten with different content. Derived layers written later
+        (e.g. the street blocks) don't change it. None if the map has no bundle.
+        """
+        if self._manifest is None:
+            return None
+        digest = hashlib.sha1()
+        for name in SOURCE_LAYERS:
+            entry = self._manifest["layers"].get(name)
+            if entry is not None:
+                digest.update(f"{name}:{bundle.layer_digest(self._bundle_dir, entry)}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _select_poi(self, columns: Optional[Sequence[Text]], where: Optional[bundle.Filters]) -> pd.DataFrame:
+        poi = self.poi
+        if where:
+            poi = poi[bundle.filter_mask(poi, where)]
+        if columns is not None:
+            poi = poi[[column for column in poi.columns if column in set(columns)]]
+        return poi
+
+    def _streams_poi(self) -> bool:
+        # POI already in memory may have changed since the bundle was written (add_pois), so they are read from memory.
+        return self.__dict__.get("_poi") is None and self._manifest is not None and "poi" in self._manifest["layers"]
+
+    def iter_poi(
+        self,
+        chunk_size: int = settings.BATCH_SIZE,
+        columns: Optional[Sequence[Text]] = None,
+        where: Optional[bundle.Filters] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """Stream the POI in chunks, reading the map bundle one row group at a time instead of loading all the POI.
+        Arguments:
+          chunk_size: The number of POI per chunk (the last chunk may be smaller).
+          columns: Only read these columns (all columns if None).
+          where: Only read the POI that match these filters, in the format of pyarrow.parquet, e.g.
+          [("amenity", "not in", osm.NEGLIGIBLE_AMENITY)]. POI where a filtered column is null never match,
+          whatever the operator (also for "not in" and "!=").
+        Returns:
+          An iterator over the chunks, in the order of poi.
+        """
+        if self._streams_poi():
+            columns = columns if columns is not None else self._columns.get("poi")
+            yield from bundle.iter_layer(self._bundle_dir, self._manifest["layers"]["poi"], chunk_size, columns, where)
+            return
+        poi = self._select_poi(columns, where)
+        for start in range(0, len(poi), chunk_size):
+            stop = start + chunk_size
+            yield poi.iloc[start:stop]
+
+    def read_poi(
+        self, columns: Optional[Sequence[Text]] = None, where: Optional[bundle.Filters] = None
+    ) -> pd.DataFrame:
+        """Read a projection of the POI without materialising all of them, with the arguments of iter_poi."""
+        if self._streams_poi():
+            columns = columns if columns is not None else self._columns.get("poi")
+            return bundle.read_layer(self._bundle_dir, self._manifest["layers"]["poi"], columns, filters=where)
+        return self._select_poi(columns, where)
+
+    def _read_layer(self, name: Text) -> Optional[pd.DataFrame]:
+        if self._manifest is None or name not in self._manifest["layers"]:
+            return None
+        return bundle.read_layer(self._bundle_dir, self._manifest["layers"][name], self._columns.get(name))
+
+    def _read_poi(self) -> Optional[gpd.GeoDataFrame]:
+        return self._read_layer("poi")
+
+    def _read_streets(self) -> Optional[gpd.GeoDataFrame]:
+        if self._manifest is not None:
+            return self._read_layer("streets")
+        return ox.graph_to_gdfs(self.osmnx_graph, nodes=False, edges=True)
+
+    def _read_nodes(self) -> Optional[gpd.GeoDataFrame]:
+        return self._read_layer("nodes")
+
+    def _read_edges(self) -> Optional[gpd.GeoDataFrame]:
+        return self._read_layer("edges")
+
+    def _read_nx_graph(self) -> Optional[nx.MultiGraph]:
+        if self.nodes is None or self.edges is None:
+            return None
+        graph = self._save_to_graph(self.nodes, self.edges)
+        graph.graph["crs"] = self.nodes.crs
+        return graph
+
+    def _read_osm_extract(self):
+        self.osmnx_graph, self.osm_geometries = osm_extract.load(self.osm_file, self.polygon_area, osm.INTERESTING_TAGS)
+
+    def _read_osmnx_graph(self) -> nx.MultiDiGraph:
+        if self.osm_file:
+            self._read_osm_extract()
+            return self.osmnx_graph
+        return osm_cache.graph_from_polygon(self.polygon_area, network_type="all")
+
+    def _read_osm_geometries(self) -> Optional[gpd.GeoDataFrame]:
+        if not self.osm_file:
+            return None
+        self._read_osm_extract()
+        return self.osm_geometries
+
+    def _read_city_polygons(self) -> gpd.GeoDataFrame:
+        return gpd.read_file(f'{Path(NEIGHBORHOODS_LIBRARY).joinpath("Tel_Aviv")}_neighborhoods.geojson')
+
     def get_poi(self) -> Tuple[GeoSeries, GeoSeries]:
         """Extract point of interests (POI) for the defined region.
         Returns:
@@ -49,7 +272,10 @@ class Map:
         """
 
         tags = osm.INTERESTING_TAGS
-        osm_poi = ox.geometries_from_polygon(self.polygon_area, tags=tags)
+        if self.osm_geometries is not None:
+            osm_poi = self.osm_geometries
+        else:
+            osm_poi = osm_cache.geometries_from_polygon(self.polygon_area, tags=tags)
 
         if ("highway" in osm_poi.columns) and ("railway" in osm_poi.columns):
             condition_streets = osm_poi.apply(
@@ -78,34 +304,172 @@ class Map:
     @staticmethod
     def _save_to_graph(nodes_gdf, edges_gdf):
         graph = nx.MultiGraph()
+        Map._add_to_graph(graph, nodes_gdf, edges_gdf)
+        return graph
 
+    @staticmethod
+    def _add_to_graph(graph: nx.MultiGraph, nodes_gdf, edges_gdf):
         nodes_gdf = nodes_gdf.drop_duplicates(subset=["osmid"])
-        node_data = nodes_gdf.set_index("osmid").to_dict("index")
-        graph.add_nodes_from(node_data.keys())
-        for node_id, node_attrs in node_data.items():
-            graph.nodes[node_id].update(node_attrs)
-
-        for index, row in edges_gdf.iterrows():
-            from_node = row["u"]
-            to_node = row["v"]
-            edge_key = row["key"]
-            edge_attrs = {key: row[key] for key in row.index if key not in ["from", "to", "key"]}
-            graph.add_edge(from_node, to_node, key=edge_key, **edge_attrs)
+        # The graph is millions of small acyclic dicts; cyclic GC passes over them only cost time.
+        with _gc_paused():
+            node_attrs = _column_records(nodes_gdf, exclude=["osmid"])
+            graph.add_nodes_from(zip(nodes_gdf["osmid"].tolist(), node_attrs))
 
-        return graph
+            # Every column but from/to/key becomes an edge attribute (u and v included), as a column zip
+            # instead of one Series per row.
+            edge_attrs = _column_records(edges_gdf, exclude=["from", "to", "key"])
+            edges = zip(edges_gdf["u"].tolist(), edges_gdf["v"].tolist(), edges_gdf["key"].tolist(), edge_attrs)
+            graph.add_edges_from(edges)
 
-    def build_graph(self):
-        processed_poi = self.poi.reset_index()
-        processed_poi = processed_poi[processed_poi.element_type == "node"]
-        ox.save_graph_shapefile(self.osmnx_graph, filepath="data/sample/", encoding="utf-8")
-        # load as GeoDataFrame
-        nodes = gpd.read_file("data/sample/nodes.shp")
-        edges = gpd.read_file("data/sample/edges.shp")
+    @staticmethod
+    def _connectable_poi(poi: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
         # Todo Add support for polygons
-        self.nodes, self.edges = connect_poi.connect_poi(processed_poi, nodes, edges, key_col="osmid", path=None, knn=6)
+        processed_poi = poi.reset_index()
+        return processed_poi[processed_poi.element_type == "node"]
+
+    def build_graph(self):
+        processed_poi = self._connectable_poi(self.poi)
+        # Convert in memory, keeping the osmnx dtypes and column names (osmid, u, v, key as columns).
+        nodes, edges = ox.graph_to_gdfs(self.osmnx_graph)
+        nodes, edges = nodes.reset_index(), edges.reset_index()
+        self.nodes, self.edges = connect_poi.connect_poi(
+            processed_poi, nodes, edges, key_col="osmid", path=None, knn=6, processes=settings.N_CPU
+        )
         self.nx_graph = self._save_to_graph(self.nodes, self.edges)
         self.nx_graph.graph["crs"] = nodes.crs
 
+    def add_pois(self, pois: gpd.GeoDataFrame, dir_name: Optional[Text] = None):
+        """Connect new POIs to the already connected network, without rebuilding the map.
+        Only the edges the new POIs project onto are split, the new projected points get
+        ids after the existing ones, and nodes, edges and graph are updated in place.
+        Arguments:
+          pois: The new POI, in the format of get_poi (osmid, element_type, geometry, ...).
+          POI whose osmid is already in the map's POI are skipped.
+          dir_name: If given, rewrite the changed layers of the map bundle in this directory.
+        """
+        pois = pois[~pois["osmid"].isin(self.poi["osmid"])]
+        pois = pois.drop_duplicates(subset=["osmid"]).to_crs(self.poi.crs)
+        if "centroid" not in pois.columns:
+            pois = pois.assign(centroid=pois.geometry.apply(lambda x: x if isinstance(x, Point) else x.centroid))
+        if "cellid" in self.poi.columns:
+            pois = pois.assign(cellid=util.cellids_from_points(pois["centroid"], self.level))
+        processed_poi = self._connectable_poi(pois)
+        if len(processed_poi):
+            self._connect_new_poi(processed_poi)
+        self.poi = gpd.GeoDataFrame(pd.concat([self.poi, pois], ignore_index=True), crs=self.poi.crs)
+        self.compact_graph = None
+        self.node_degrees = None
+
+        if dir_name:
+            manifest = bundle.read_manifest(dir_name, self.map_name)
+            changed = ["poi", "nodes", "edges"]
+            if manifest is not None and "degrees" in manifest["layers"]:
+                changed.append("degrees")
+            self.write_map(dir_name, layers=changed)
+
+    def _connect_new_poi(self, processed_poi: gpd.GeoDataFrame):
+        # The exact nearest street edge of every new POI, connection edges of earlier POI excluded.
+        streets = self.edges[self.edges["highway"] != connect_poi.EDGE_HIGHWAY]
+        positions, _, _ = connect_poi.nearest_lines_tiled(
+            processed_poi.geometry.to_crs(epsg=connect_poi.METER_EPSG),
+            streets.geometry.to_crs(epsg=connect_poi.METER_EPSG),
+            knn=6,
+            processes=settings.N_CPU,
+        )
+        # Connecting against only those edges projects every POI onto the same edge, and splits nothing else.
+        affected = self.edges.loc[streets.index[np.unique(positions)]]
+        endpoints = self.nodes[self.nodes["osmid"].isin(np.union1d(affected["u"], affected["v"]))]
+        existing_ids = self.nodes["osmid"][self.nodes["osmid"] >= connect_poi.OSMID_PREFIX]
+        osmid_start = max(connect_poi.OSMID_PREFIX, int(existing_ids.max()) + 1 if len(existing_ids) else 0)
+        nodes, edges = connect_poi.connect_poi(
+            processed_poi,
+            endpoints,
+            affected,
+            key_col="osmid",
+            path=None,
+            knn=6,
+            processes=settings.N_CPU,
+            osmid_start=osmid_start,
+        )
+        new_nodes = nodes[~nodes["osmid"].isin(endpoints["osmid"])]
+        new_edges = edges[~edges.index.isin(affected.index)]
+        removed = affected.index[~affected.index.isin(edges.index)]
+        new_edges.index = pd.RangeIndex(self.edges.index.max() + 1, self.edges.index.max() + 1 + len(new_edges))
+
+        # The graph has one edge per undirected (u, v, key): a removed edge may also stand for a kept row
+        # (the other direction of a two-way street), which is added back like _save_to_graph would.
+        removed_ids = set(_edge_identities(self.edges.loc[removed])) - {None}
+        kept = self.edges.drop(removed)
+        shared = kept[[identity in removed_ids for identity in _edge_identities(kept)]]
+        self.nx_graph.remove_edges_from(removed_ids)
+        self._add_to_graph(self.nx_graph, new_nodes, pd.concat([shared, new_edges]))
+
+        self.nodes = gpd.GeoDataFrame(pd.concat([self.nodes, new_nodes]), crs=self.nodes.crs)
+        self.edges = gpd.GeoDataFrame(pd.concat([kept, new_edges]), crs=self.edges.crs)
+
+    def assign_cellids(self, column: Text = "cellid", level: Optional[int] = None):
+        """Attach the S2CellId (int64) of every POI centroid as a column of poi.
+        Arguments:
+          column: The name of the column to write.
+          level: The S2Cell level, defaults to the level of the map.
+        """
+        level = self.level if level is None else level
+        self.poi[column] = util.cellids_from_points(self.poi["centroid"], level)
+
+    def get_compact_graph(self) -> CompactGraph:
+        """Returns the CSR representation of the graph, built once from nodes and edges."""
+        if self.compact_graph is None:
+            self.compact_graph = CompactGraph.from_frames(self.nodes, self.edges)
+        return self.compact_graph
+
+    def get_node_degrees(self) -> pd.Series:
+        """Returns the degree of every node in the graph, keyed by osmid.
+        The table is read from the map bundle if it was persisted, else computed once from the
+        compact graph, and cached on the map.
+        """
+        if self.node_degrees is None:
+            degrees = self._read_layer("degrees")
+            if degrees is not None:
+                self.node_degrees = pd.Series(
+                    degrees["degree"].to_numpy(), index=pd.Index(degrees["osmid"], name="osmid")
+                )
+            else:
+                self.node_degrees = self.get_compact_graph().degrees()
+        return self.node_degrees
+
+    def get_neighborhood_cells(self) -> CellTable:
+        """Returns the table of the S2Cells (at the level of the map) inside every neighbourhood of
+        city_polygons. The table is read from the map bundle if it was persisted at the level of the map
+        from the current city_polygons, else built once and cached on the map. The bundle is never written
+        here, the table is persisted when the map is built (or with write_map(dir_name, layers=["neighborhood_cells"])).
+        """
+        if self.neighborhood_cells is None:
+            polygons = self.city_polygons.geometry
+            entry = self._manifest["layers"].get("neighborhood_cells") if self._manifest is not None else None
+            built_from = (self.level, polygons_digest(polygons))
+            if entry is not None and (entry.get("level"), entry.get("polygons_digest")) == built_from:
+                self.neighborhood_cells = CellTable.from_frame(self._read_layer("neighborhood_cells"), self.level)
+            else:
+                self.neighborhood_cells = CellTable.from_polygons(polygons, self.level)
+        return self.neighborhood_cells
+
+    def get_street_blocks(self) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+        """Returns the non-primary and primary street blocks (see blocks.street_blocks).
+        They are read from the map bundle if they were computed from its current streets layer, else
+        computed once and cached on the map. The bundle is never written here, the blocks are persisted
+        when the map is built (or with write_map(dir_name, layers=["street_blocks"])).
+        """
+        if self.street_blocks is None:
+            layers = self._manifest["layers"] if self._manifest is not None else {}
+            entry = layers.get("street_blocks")
+            if entry is not None and "streets" in layers and entry.get("streets_digest") == (
+                bundle.layer_digest(self._bundle_dir, layers["streets"])
+            ):
+                self.street_blocks = blocks.from_frame(self._read_layer("street_blocks"))
+            else:
+                self.street_blocks = blocks.street_blocks(self.streets)
+        return self.street_blocks
+
     def get_valid_path(self, dir_name: Text, name_ending: Text, file_ending: Text) -> Optional[Text]:
         """Creates the file path and checks validity.
         Arguments:
@@ -132,36 +496,84 @@ class Map:
 
         return path
 
-    def write_map(self, dir_name: Text):
-        """Save POI to disk."""
-        # Write POI.
-        pd_poi = copy.deepcopy(self.poi)
-        if "s2cellids" in pd_poi.columns:
-            pd_poi["cellids"] = pd_poi["s2cellids"].apply(lambda x: util.cellids_from_s2cellids(x))
-        # pd_poi.drop(['s2cellids'], 1, inplace=True)
-
-        path = self.get_valid_path(dir_name, "_poi", ".pkl")
-        if not os.path.exists(path):
-            pd_poi.to_pickle(path)
-        else:
-            logging.info(f"path {path} already exist.")
-
-        # Write streets.
-        pd_streets = copy.deepcopy(self.streets)
-
-        path = self.get_valid_path(dir_name, "_streets", ".pkl")
-        if not os.path.exists(path):
-            pd_streets.to_pickle(path)
-        else:
-            logging.info(f"path {path} already exist.")
-
-        # Write graph.
-        base_filename = self.map_name.lower() + "_graph"
-        path = os.path.join(dir_name, base_filename + ".gpickle")
-        if not os.path.exists(path):
-            nx.write_gpickle(self.nx_graph, path)
-        else:
-            logging.info(f"path {path} already exist.")
+    def _layer_frames(self, names: Sequence[Text]) -> Dict[Text, Tuple[pd.DataFrame, Text]]:
+        layers = {}
+        if "poi" in names:
+            pd_poi = copy.deepcopy(self.poi)
+            if "s2cellids" in pd_poi.columns:
+                pd_poi["cellids"] = pd_poi["s2cellids"].apply(lambda x: util.cellids_from_s2cellids(x))
+                pd_poi.drop(["s2cellids"], axis=1, inplace=True)
+            layers["poi"] = (pd_poi, bundle.PARQUET)
+        if "streets" in names:
+            layers["streets"] = (self.streets, bundle.PARQUET)
+        if "nodes" in names:
+            layers["nodes"] = (self.nodes, bundle.FEATHER)
+        if "edges" in names:
+            layers["edges"] = (self.edges, bundle.FEATHER)
+        if "degrees" in names:
+            degrees = self.get_node_degrees().rename("degree").reset_index()
+            layers["degrees"] = (degrees, bundle.FEATHER)
+        if "neighborhood_cells" in names:
+            layers["neighborhood_cells"] = (self.get_neighborhood_cells().to_frame(), bundle.FEATHER)
+        if "street_blocks" in names:
+            layers["street_blocks"] = (blocks.to_frame(*self.get_street_blocks()), bundle.FEATHER)
+        return layers
+
+    def write_map(
+        self,
+        dir_name: Text,
+        write_degrees: bool = False,
+        overwrite: bool = False,
+        layers: Optional[Sequence[Text]] = None,
+        write_neighborhood_cells: bool = False,
+        write_street_blocks: bool = False,
+    ):
+        """Save the map to disk as a bundle of columnar files and a manifest.
+        Arguments:
+          dir_name: The directory to write the map files to.
+          write_degrees: Whether to also persist the node degree table.
+          overwrite: Whether to replace layer files that already exist.
+          layers: Only (re)write these layers, keeping the other layers of the existing bundle.
+          write_neighborhood_cells: Whether to also persist the S2Cell table of the neighbourhoods.
+          write_street_blocks: Whether to also persist the street blocks.
+        """
+        manifest = bundle.read_manifest(dir_name, self.map_name) if os.path.exists(dir_name) else None
+        entries = manifest["layers"] if manifest is not None else {}
+        names = layers if layers is not None else SOURCE_LAYERS
+        if write_degrees and "degrees" not in names:
+            names = [*names, "degrees"]
+        if write_neighborhood_cells and "neighborhood_cells" not in names:
+            names = [*names, "neighborhood_cells"]
+        if write_street_blocks and "street_blocks" not in names:
+            names = [*names, "street_blocks"]
+
+        for name, (frame, file_ending) in self._layer_frames(names).items():
+            path = self.get_valid_path(dir_name, f"_{name}", file_ending)
+            if os.path.exists(path) and name in entries and not overwrite and layers is None:
+                logging.info(f"path {path} already exist.")
+                continue
+            entries[name] = bundle.write_layer(frame, path)
+            if name == "street_blocks" and "streets" in entries:
+                # The blocks are valid as long as the streets layer they were computed from doesn't change.
+                entries[name]["streets_digest"] = bundle.layer_digest(dir_name, entries["streets"])
+            if name == "neighborhood_cells":
+                # The table is valid for its level and the neighbourhood polygons it was built from.
+                entries[name]["level"] = self.neighborhood_cells.level
+                entries[name]["polygons_digest"] = polygons_digest(self.city_polygons.geometry)
+
+        manifest = {
+            "version": bundle.BUNDLE_VERSION,
+            "map_name": self.map_name,
+            "level": self.level,
+            "crs": self._crs_name() if manifest is None or "nodes" in names else manifest["crs"],
+            "layers": entries,
+        }
+        bundle.write_manifest(dir_name, manifest)
+        if self._manifest is None or self._bundle_dir == dir_name:
+            self._bundle_dir, self._manifest = dir_name, manifest
+
+    def _crs_name(self) -> Optional[Text]:
+        return str(self.nodes.crs) if self.nodes.crs is not None else None
 
     @staticmethod
     def load_poi(path: Text):
@@ -174,8 +586,27 @@ class Map:
 
         return poi_pandas
 
-    def load_map(self, dir_name: Text):
-        """Load POI from disk."""
+    def load_map(self, dir_name: Text, columns: Optional[Dict[Text, Sequence[Text]]] = None):
+        """Load the map from disk. Layers of a map bundle are read lazily, on first access.
+        Arguments:
+          dir_name: The directory of the map files.
+          columns: Optional column projection per layer (e.g. {"poi": ["name", "centroid"]}).
+        """
+        manifest = bundle.read_manifest(dir_name, self.map_name)
+        if manifest is None:
+            self._load_legacy_map(dir_name)
+            return
+
+        # Only the manifest is read here, the layers are read by their attributes on first access.
+        self._bundle_dir, self._manifest, self._columns = dir_name, manifest, columns or {}
+        self.poi = self.streets = self.nodes = self.edges = self.nx_graph = None
+        self.node_degrees = None
+        self.neighborhood_cells = None
+        self.street_blocks = None
+        self.compact_graph = None
+
+    def _load_legacy_map(self, dir_name: Text):
+        """Load a map written as pickles (before map bundles)."""
 
         # Load POI.
         path = self.get_valid_path(dir_name, "_poi", ".pkl")
@@ -190,3 +621,8 @@ class Map:
         assert os.path.exists(path), f"path {path} doesn't exists"
         self.nx_graph = nx.read_gpickle(path)
         self.nodes, self.edges = ox.graph_to_gdfs(self.nx_graph)
+
+        # Load node degrees if they were persisted.
+        path = self.get_valid_path(dir_name, "_degrees", ".pkl")
+        if os.path.exists(path):
+            self.node_degrees = pd.read_pickle(path)
@@ -0,0 +1,158 @@
+"""Content-addressed local cache of osmnx downloads.
+
+Entries are keyed by a hash of everything that determines the result: the
+kind of query, the region polygon (WKB) or place name, the tags, the network
+type and the osmnx version and settings. A warm rebuild of a region does no
+network I/O. The cache is bounded in size, least recently used entries are
+evicted first.
+
+Usage:
+  python3 -m HeGel2.geo.map_processor.osm_cache info
+  python3 -m HeGel2.geo.map_processor.osm_cache clear [--kind graph|geometries|place]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Text
+
+import geopandas as gpd
+import networkx as nx
+import osmnx as ox
+
+from HeGel2 import settings
+
+# Bump when the cached objects change shape, so old entries are never read.
+CACHE_FORMAT = 1
+ENDING = ".pkl"
+
+
+class Entry(NamedTuple):
+    path: Text
+    kind: Text
+    size: int
+    last_used: float
+
+
+def cache_key(kind: Text, **parts) -> Text:
+    """Returns the key of a query: its kind and a digest of all the parts that determine its result."""
+    parts = {
+        **parts,
+        "format": CACHE_FORMAT,
+        "osmnx": ox.__version__,
+        "useful_tags_node": list(ox.settings.useful_tags_node),
+        "useful_tags_way": list(ox.settings.useful_tags_way),
+    }
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{kind}-{digest}"
+
+
+class OsmCache:
+    """A directory of pickled query results, bounded to max_bytes by evicting the least recently used."""
+
+    def __init__(self, directory: Text = settings.OSM_CACHE_DIR, max_bytes: int = settings.OSM_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key: Text) -> Text:
+        return os.path.join(self.directory, key + ENDING)
+
+    def get(self, key: Text) -> Optional[Any]:
+        """Returns the cached value of the key, None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                value = pickle.load(cache_file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path)  # mark as recently used
+        return value
+
+    def put(self, key: Text, value: Any):
+        """Stores the value atomically and evicts the least recently used entries beyond max_bytes."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as cache_file:
+            pickle.dump(value, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def get_or_compute(self, key: Text, compute: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def entries(self) -> List[Entry]:
+        """Returns the entries, least recently used first."""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(ENDING):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append(Entry(path, name.split("-", 1)[0], stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry.last_used)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(entry.size for entry in entries)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(entry.path)
+            total -= entry.size
+
+    def invalidate(self, kind: Optional[Text] = None) -> int:
+        """Removes all entries, or only those of one kind. Returns the number of removed entries."""
+        removed = [entry for entry in self.entries() if kind is None or entry.kind == kind]
+        for entry in removed:
+            os.remove(entry.path)
+        return len(removed)
+
+
+def graph_from_polygon(polygon, network_type: Text = "all", cache: Optional[OsmCache] = None) -> nx.MultiDiGraph:
+    """Cached ox.graph_from_polygon."""
+    cache = cache or OsmCache()
+    key = cache_key("graph", polygon=polygon.wkb_hex, network_type=network_type)
+    return cache.get_or_compute(key, lambda: ox.graph_from_polygon(polygon, network_type=network_type))
+
+
+def geometries_from_polygon(polygon, tags: Dict, cache: Optional[OsmCache] = None) -> gpd.GeoDataFrame:
+    """Cached ox.geometries_from_polygon."""
+    cache = cache or OsmCache()
+    key = cache_key("geometries", polygon=polygon.wkb_hex, tags=tags)
+    return cache.get_or_compute(key, lambda: ox.geometries_from_polygon(polygon, tags=tags))
+
+
+def geometries_from_place(place: Text, tags: Dict, cache: Optional[OsmCache] = None) -> gpd.GeoDataFrame:
+    """Cached ox.geometries_from_place (the geocoding of the place included)."""
+    cache = cache or OsmCache()
+    key = cache_key("place", place=place, tags=tags)
+    return cache.get_or_compute(key, lambda: ox.geometries_from_place(place, tags))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the osmnx download cache.")
+    parser.add_argument("command", choices=["info", "clear"])
+    parser.add_argument("--kind", choices=["graph", "geometries", "place"], help="Only clear entries of this kind.")
+    parser.add_argument("--dir", default=settings.OSM_CACHE_DIR, help="The cache directory.")
+    args = parser.parse_args()
+
+    cache = OsmCache(args.dir)
+    if args.command == "clear":
+        print(f"Removed {cache.invalidate(args.kind)} entries from {args.dir}.")
+    else:
+        entries = cache.entries()
+        print(f"{len(entries)} entries, {sum(entry.size for entry in entries) / 2 ** 20:.1f} MiB in {args.dir}.")
+        for kind in sorted({entry.kind for entry in entries}):
+            print(f"  {kind}: {sum(entry.kind == kind for entry in entries)}")
+
+
+if __name__ == "__main__":
+    main()
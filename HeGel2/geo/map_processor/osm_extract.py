@@ -0,0 +1,264 @@
+"""Offline ingestion of a region from a local OSM extract (.osm, .osm.bz2 or .osm.pbf).
+
+The extract is streamed and clipped to the (buffered) region polygon, keeping
+only the network ways and the POI features the online path would download from
+Overpass, together with the nodes they reference. The clipped XML files are
+then read by osmnx with the same steps as ox.graph_from_polygon and
+ox.geometries_from_polygon, so the result has the same structure as the
+online path. Memory is bounded by the size of the region, not the extract.
+
+.osm.pbf files need pyosmium (pip install osmium).
+"""
+
+import bz2
+import os
+import re
+import tempfile
+from typing import Dict, Iterator, NamedTuple, Optional, Set, Text, Tuple
+from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
+
+import geopandas as gpd
+import networkx as nx
+import osmnx as ox
+from shapely.geometry import Point
+from shapely.prepared import prep
+
+from HeGel2.geo.map_processor import osm
+
+try:
+    import osmium
+except ImportError:  # pragma: no cover
+    osmium = None
+
+# The buffer ox.graph_from_polygon downloads and simplifies the network in (clean_periphery), in meters.
+NETWORK_BUFFER = 500
+
+# The Overpass filter of osmnx's network_type="all": key -> regex the value must NOT match (unanchored, as
+# in Overpass). The "highway" key must be present.
+NETWORK_EXCLUDE = {
+    "area": re.compile("yes"),
+    "access": re.compile("private"),
+    "highway": re.compile("abandoned|construction|planned|platform|proposed|raceway"),
+    "service": re.compile("private"),
+}
+
+
+class Element(NamedTuple):
+    """A node, way or relation of the extract, with only the fields osmnx reads."""
+
+    kind: Text
+    id: int
+    tags: Dict[Text, Text]
+    lon: float = 0.0
+    lat: float = 0.0
+    refs: Tuple[int, ...] = ()
+    members: Tuple[Tuple[Text, int, Text], ...] = ()
+
+
+def _read_xml(path: Text) -> Iterator[Element]:
+    opener = bz2.open if path.endswith(".bz2") else open
+    with opener(path, "rb") as osm_file:
+        context = ElementTree.iterparse(osm_file, events=("start", "end"))
+        _, root = next(context)
+        for event, item in context:
+            if event != "end" or item.tag not in ("node", "way", "relation"):
+                continue
+            tags = {tag.get("k"): tag.get("v") for tag in item.iter("tag")}
+            if item.tag == "node":
+                yield Element("node", int(item.get("id")), tags, float(item.get("lon")), float(item.get("lat")))
+            elif item.tag == "way":
+                refs = tuple(int(nd.get("ref")) for nd in item.iter("nd"))
+                yield Element("way", int(item.get("id")), tags, refs=refs)
+            else:
+                members = tuple((m.get("type"), int(m.get("ref")), m.get("role", "")) for m in item.iter("member"))
+                yield Element("relation", int(item.get("id")), tags, members=members)
+            root.clear()
+
+
+def _read_pbf(path: Text) -> Iterator[Element]:
+    if osmium is None:
+        raise ImportError(f"Reading {path} needs pyosmium: pip install osmium")
+    member_types = {"n": "node", "w": "way", "r": "relation"}
+    for item in osmium.FileProcessor(path):
+        tags = {tag.k: tag.v for tag in item.tags}
+        if item.is_node():
+            yield Element("node", item.id, tags, item.location.lon, item.location.lat)
+        elif item.is_way():
+            yield Element("way", item.id, tags, refs=tuple(node.ref for node in item.nodes))
+        elif item.is_relation():
+            members = tuple((member_types[m.type], m.ref, m.role) for m in item.members)
+            yield Element("relation", item.id, tags, members=members)
+
+
+def read_elements(path: Text) -> Iterator[Element]:
+    """Streams the nodes, ways and relations of an OSM extract, in file order."""
+    return _read_pbf(path) if path.endswith(".pbf") else _read_xml(path)
+
+
+def is_network_way(tags: Dict[Text, Text]) -> bool:
+    """Whether the way passes the network filter of ox.graph_from_polygon (network_type="all")."""
+    return "highway" in tags and not any(
+        key in tags and pattern.search(tags[key]) for key, pattern in NETWORK_EXCLUDE.items()
+    )
+
+
+def matches_tags(tags: Dict[Text, Text], query: Dict) -> bool:
+    """Whether the element has any of the query tags, with osmnx's semantics (True, a value or a list of values)."""
+    for key, values in query.items():
+        if key not in tags:
+            continue
+        if values is True or (isinstance(values, str) and tags[key] == values):
+            return True
+        if isinstance(values, list) and tags[key] in values:
+            return True
+    return False
+
+
+def _write_element(out, element: Element):
+    if element.kind == "node":
+        out.write(f'<node id="{element.id}" lat="{element.lat!r}" lon="{element.lon!r}">')
+    else:
+        out.write(f'<{element.kind} id="{element.id}">')
+    for ref in element.refs:
+        out.write(f'<nd ref="{ref}"/>')
+    for kind, ref, role in element.members:
+        out.write(f'<member type="{kind}" ref="{ref}" role={quoteattr(role)}/>')
+    for key, value in element.tags.items():
+        out.write(f"<tag k={quoteattr(key)} v={quoteattr(value)}/>")
+    out.write(f"</{element.kind}>\n")
+
+
+class _Selection(NamedTuple):
+    nodes: Dict[Text, Set[int]]
+    ways: Dict[Text, Set[int]]
+    relations: Set[int]
+
+
+def _select(path: Text, polygons: Dict, tags: Dict) -> _Selection:
+    """Pass 1 and 2 of clip: the ids of the elements to write per layer ("network" and "poi")."""
+    prepared = {layer: prep(polygon) for layer, polygon in polygons.items()}
+    bounds = {layer: polygon.bounds for layer, polygon in polygons.items()}
+
+    def inside(layer, element):
+        minx, miny, maxx, maxy = bounds[layer]
+        return minx <= element.lon <= maxx and miny <= element.lat <= maxy and (
+            prepared[layer].contains(Point(element.lon, element.lat))
+        )
+
+    # Pass 1: the nodes inside each polygon, the selected ways and relations, and the members they need.
+    inside_nodes: Dict[Text, Set[int]] = {layer: set() for layer in polygons}
+    nodes: Dict[Text, Set[int]] = {layer: set() for layer in polygons}
+    ways: Dict[Text, Dict[int, Tuple[int, ...]]] = {layer: {} for layer in polygons}
+    touching_ways: Set[int] = set()
+    relations: Set[int] = set()
+    member_ways: Set[int] = set()
+    for element in read_elements(path):
+        if element.kind == "node":
+            for layer, layer_nodes in inside_nodes.items():
+                if inside(layer, element):
+                    layer_nodes.add(element.id)
+            if element.id in inside_nodes["poi"] and matches_tags(element.tags, tags):
+                nodes["poi"].add(element.id)
+        elif element.kind == "way":
+            if is_network_way(element.tags) and any(ref in inside_nodes["network"] for ref in element.refs):
+                ways["network"][element.id] = element.refs
+            if any(ref in inside_nodes["poi"] for ref in element.refs):
+                touching_ways.add(element.id)
+                if matches_tags(element.tags, tags):
+                    ways["poi"][element.id] = element.refs
+        elif matches_tags(element.tags, tags) and any(
+            ref in (touching_ways if kind == "way" else inside_nodes["poi"]) for kind, ref, _ in element.members
+        ):
+            relations.add(element.id)
+            member_ways.update(ref for kind, ref, _ in element.members if kind == "way")
+            nodes["poi"].update(ref for kind, ref, _ in element.members if kind == "node")
+
+    # Pass 2: the nodes of the member ways that were not selected themselves.
+    missing_ways = member_ways - set(ways["poi"])
+    if missing_ways:
+        for element in read_elements(path):
+            if element.kind == "way" and element.id in missing_ways:
+                ways["poi"][element.id] = element.refs
+            elif element.kind == "relation":
+                break
+
+    for layer, layer_ways in ways.items():
+        for refs in layer_ways.values():
+            nodes[layer].update(refs)
+    return _Selection(nodes, {layer: set(layer_ways) for layer, layer_ways in ways.items()}, relations)
+
+
+def clip(path: Text, network_polygon, poi_polygon, network_path: Text, poi_path: Text, tags: Dict):
+    """Clips an extract to the network ways and POI features of a region, in three streaming passes.
+    Like Overpass, a way is selected if any of its nodes is inside the polygon, a relation if any
+    of its members is, and both are written with all the ways and nodes they reference.
+    Arguments:
+      path: The OSM extract.
+      network_polygon: The polygon of the network ways.
+      poi_polygon: The polygon of the POI features.
+      network_path: The OSM XML file to write the network to.
+      poi_path: The OSM XML file to write the POI features to.
+      tags: The POI tags, as in ox.geometries_from_polygon.
+    """
+    selection = _select(path, {"network": network_polygon, "poi": poi_polygon}, tags)
+
+    # Pass 3: write both files.
+    header = "<?xml version='1.0' encoding='UTF-8'?>\n<osm version=\"0.6\" generator=\"HeGel2 osm_extract\">\n"
+    with open(network_path, "w", encoding="utf-8") as network_file, open(poi_path, "w", encoding="utf-8") as poi_file:
+        outputs = {"network": network_file, "poi": poi_file}
+        for out in outputs.values():
+            out.write(header)
+        for element in read_elements(path):
+            for layer, out in outputs.items():
+                if element.kind == "node":
+                    selected = element.id in selection.nodes[layer]
+                elif element.kind == "way":
+                    selected = element.id in selection.ways[layer]
+                else:
+                    selected = layer == "poi" and element.id in selection.relations
+                if selected:
+                    _write_element(out, element)
+        for out in outputs.values():
+            out.write("</osm>\n")
+
+
+def _buffered(polygon, distance: float):
+    """The polygon buffered by a distance in meters, as osmnx buffers it."""
+    poly_proj, crs_utm = ox.projection.project_geometry(polygon)
+    poly_buff, _ = ox.projection.project_geometry(poly_proj.buffer(distance), crs=crs_utm, to_latlong=True)
+    return poly_buff
+
+
+def graph_from_network_file(network_path: Text, polygon) -> nx.MultiDiGraph:
+    """The steps of ox.graph_from_polygon(polygon, network_type="all") on a clipped network file."""
+    poly_buff = _buffered(polygon, NETWORK_BUFFER)
+    graph_buff = ox.graph_from_xml(network_path, bidirectional=False, simplify=False, retain_all=True)
+    graph_buff = ox.truncate.truncate_graph_polygon(graph_buff, poly_buff, True, False)
+    graph_buff = ox.simplify_graph(graph_buff)
+    graph = ox.truncate.truncate_graph_polygon(graph_buff, polygon, False, False)
+    street_counts = ox.stats.count_streets_per_node(graph_buff, nodes=graph.nodes)
+    nx.set_node_attributes(graph, values=street_counts, name="street_count")
+    return graph
+
+
+def load(
+    path: Text, polygon, tags: Dict = osm.INTERESTING_TAGS, work_dir: Optional[Text] = None
+) -> Tuple[nx.MultiDiGraph, gpd.GeoDataFrame]:
+    """Builds the osmnx graph and the tagged POI of a region from a local OSM extract.
+    Arguments:
+      path: The .osm, .osm.bz2 or .osm.pbf extract.
+      polygon: The region polygon.
+      tags: The POI tags, as in ox.geometries_from_polygon.
+      work_dir: Where to write the clipped files, a temporary directory if None.
+    Returns:
+      The graph (as ox.graph_from_polygon) and the POI features (as ox.geometries_from_polygon).
+    """
+    assert os.path.exists(path), f"OSM extract {path} doesn't exist."
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        network_path = os.path.join(tmp_dir, "network.osm")
+        poi_path = os.path.join(tmp_dir, "poi.osm")
+        clip(path, _buffered(polygon, NETWORK_BUFFER), polygon, network_path, poi_path, tags)
+        graph = graph_from_network_file(network_path, polygon)
+        geometries = ox.geometries_from_xml(poi_path, polygon=polygon, tags=tags)
+    return graph, geometries
@@ -16,15 +16,13 @@
 import sys
 import webbrowser
 from collections import namedtuple
-from typing import List, Optional, Sequence, Text
+from typing import List, Optional, Sequence, Text, Tuple
 
 import folium
-import geographiclib
 import numpy as np
-import osmnx as ox
 import pandas as pd
+import pyproj
 from absl import logging
-from geopy.distance import geodesic
 from numpy import int64
 from s2geometry import pywraps2 as s2
 from shapely.geometry import LineString
@@ -38,6 +36,108 @@ MAX_FAILED_ATTEMPTS = 50
 CoordsYX = namedtuple("CoordsYX", ("y x"))
 CoordsXY = namedtuple("CoordsXY", ("x y"))
 
+# Mean earth radius in meters, as used by osmnx.
+EARTH_RADIUS_M = 6_371_009
+WGS84_GEOD = pyproj.Geod(ellps="WGS84")
+
+
+def haversine_distances(lat_1, lon_1, lat_2, lon_2) -> np.ndarray:
+    """Calculate the great-circle distances between pairs of coordinates.
+    Arguments:
+      lat_1, lon_1: Coordinates (degrees) of the start points.
+      lat_2, lon_2: Coordinates (degrees) of the end points. All four arrays
+      are broadcast against each other.
+    Returns:
+      Distances in meters.
+    """
+    y_1, y_2 = np.deg2rad(lat_1), np.deg2rad(lat_2)
+    d_y = y_2 - y_1
+    d_x = np.deg2rad(lon_2) - np.deg2rad(lon_1)
+    h = np.sin(d_y / 2) ** 2 + np.cos(y_1) * np.cos(y_2) * np.sin(d_x / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.minimum(1, h))) * EARTH_RADIUS_M
+
+
+def pairwise_haversine_distances(lat_1, lon_1, lat_2, lon_2) -> np.ndarray:
+    """Calculate the great-circle distances from every start point to every
+    end point.
+    Arguments:
+      lat_1, lon_1: 1D coordinates (degrees) of the n start points.
+      lat_2, lon_2: 1D coordinates (degrees) of the m end points.
+    Returns:
+      An (n, m) array of distances in meters.
+    """
+    lat_1, lon_1 = np.asarray(lat_1, dtype=float)[:, None], np.asarray(lon_1, dtype=float)[:, None]
+    return haversine_distances(lat_1, lon_1, np.asarray(lat_2, dtype=float), np.asarray(lon_2, dtype=float))
+
+
+def _geodesic_inverse(lat_1, lon_1, lat_2, lon_2):
+    arrays = (np.asarray(a, dtype=float) for a in (lat_1, lon_1, lat_2, lon_2))
+    lat_1, lon_1, lat_2, lon_2 = np.broadcast_arrays(*arrays)
+    azimuth, _, distance = WGS84_GEOD.inv(lon_1.ravel(), lat_1.ravel(), lon_2.ravel(), lat_2.ravel())
+    return np.reshape(azimuth, lat_1.shape), np.reshape(distance, lat_1.shape)
+
+
+def geodesic_distances(lat_1, lon_1, lat_2, lon_2) -> np.ndarray:
+    """Calculate the WGS84 geodesic distances between pairs of coordinates.
+    Arguments:
+      lat_1, lon_1: Coordinates (degrees) of the start points.
+      lat_2, lon_2: Coordinates (degrees) of the end points. All four arrays
+      are broadcast against each other.
+    Returns:
+      Distances in meters.
+    """
+    return _geodesic_inverse(lat_1, lon_1, lat_2, lon_2)[1]
+
+
+def pairwise_geodesic_distances(lat_1, lon_1, lat_2, lon_2) -> np.ndarray:
+    """Calculate the WGS84 geodesic distances from every start point to every
+    end point.
+    Arguments:
+      lat_1, lon_1: 1D coordinates (degrees) of the n start points.
+      lat_2, lon_2: 1D coordinates (degrees) of the m end points.
+    Returns:
+      An (n, m) array of distances in meters.
+    """
+    lat_1, lon_1 = np.asarray(lat_1, dtype=float)[:, None], np.asarray(lon_1, dtype=float)[:, None]
+    return geodesic_distances(lat_1, lon_1, np.asarray(lat_2, dtype=float), np.asarray(lon_2, dtype=float))
+
+
+def geodesic_bearings(lat_1, lon_1, lat_2, lon_2) -> np.ndarray:
+    """Calculate the WGS84 geodesic bearings between pairs of coordinates.
+    Arguments:
+      lat_1, lon_1: Coordinates (degrees) of the start points.
+      lat_2, lon_2: Coordinates (degrees) of the end points.
+    Returns:
+      Bearings in degrees clockwise from north, in [0, 360).
+    """
+    return _geodesic_inverse(lat_1, lon_1, lat_2, lon_2)[0] % 360
+
+
+def great_circle_bearings(lat_1, lon_1, lat_2, lon_2) -> np.ndarray:
+    """Calculate the initial great-circle bearings between pairs of coordinates.
+    Arguments:
+      lat_1, lon_1: Coordinates (degrees) of the start points.
+      lat_2, lon_2: Coordinates (degrees) of the end points.
+    Returns:
+      Bearings in degrees clockwise from north, in [0, 360).
+    """
+    y_1, y_2 = np.deg2rad(lat_1), np.deg2rad(lat_2)
+    d_x = np.deg2rad(np.asarray(lon_2, dtype=float) - np.asarray(lon_1, dtype=float))
+    y = np.sin(d_x) * np.cos(y_2)
+    x = np.cos(y_1) * np.sin(y_2) - np.sin(y_1) * np.cos(y_2) * np.cos(d_x)
+    return np.degrees(np.arctan2(y, x)) % 360
+
+
+def polyline_length(coords: np.ndarray) -> float:
+    """Calculate the great-circle length of a polyline.
+    Arguments:
+      coords: An (n, 2) array of lng-lat coordinates.
+    Returns:
+      The length in meters.
+    """
+    coords = np.asarray(coords, dtype=float)
+    return float(haversine_distances(coords[:-1, 1], coords[:-1, 0], coords[1:, 1], coords[1:, 0]).sum())
+
 
 def get_distance_between_points(start_point: Point, end_point: Point) -> float:
     """Calculate the line length in meters.
@@ -47,7 +147,7 @@ def get_distance_between_points(start_point: Point, end_point: Point) -> float:
     Returns:
       Distance length in meters.
     """
-    dist = ox.distance.great_circle_vec(start_point.y, start_point.x, end_point.y, end_point.x)
+    dist = float(haversine_distances(start_point.y, start_point.x, end_point.y, end_point.x))
     assert dist >= 0, f"start_point: {Point} | end_point: {end_point}"
     return dist
 
@@ -118,6 +218,199 @@ def neighbor_cellid(cellid: int, celllist: Optional[List[int]]) -> int:
         return cellid
 
 
+# S2 cell id constants, see s2geometry's s2cell_id.h.
+S2_MAX_LEVEL = 30
+S2_LOOKUP_BITS = 4
+S2_SWAP_MASK = 0x01
+S2_INVERT_MASK = 0x02
+_S2_POS_TO_IJ = ((0, 1, 3, 2), (0, 2, 3, 1), (3, 2, 0, 1), (3, 1, 0, 2))
+_S2_POS_TO_ORIENTATION = (S2_SWAP_MASK, 0, 0, S2_INVERT_MASK | S2_SWAP_MASK)
+
+
+def _s2_lookup_tables():
+    """Builds the Hilbert curve lookup tables mapping (i, j, orientation) of a
+    16x16 block to (position, orientation) and back."""
+    lookup_pos = np.zeros(1 << (2 * S2_LOOKUP_BITS + 2), dtype=np.uint64)
+    lookup_ij = np.zeros(1 << (2 * S2_LOOKUP_BITS + 2), dtype=np.uint64)
+
+    def init(level, i, j, orig_orientation, pos, orientation):
+        if level == S2_LOOKUP_BITS:
+            ij = (i << S2_LOOKUP_BITS) + j
+            lookup_pos[(ij << 2) + orig_orientation] = (pos << 2) + orientation
+            lookup_ij[(pos << 2) + orig_orientation] = (ij << 2) + orientation
+            return
+        level, i, j, pos = level + 1, i << 1, j << 1, pos << 2
+        r = _S2_POS_TO_IJ[orientation]
+        for index in range(4):
+            init(
+                level,
+                i + (r[index] >> 1),
+                j + (r[index] & 1),
+                orig_orientation,
+                pos + index,
+                orientation ^ _S2_POS_TO_ORIENTATION[index],
+            )
+
+    for orientation in range(4):
+        init(0, 0, 0, orientation, 0, orientation)
+    return lookup_pos, lookup_ij
+
+
+_S2_LOOKUP_POS, _S2_LOOKUP_IJ = _s2_lookup_tables()
+
+
+def _s2_face_uv_from_xyz(x: np.ndarray, y: np.ndarray, z: np.ndarray):
+    components = np.stack([x, y, z])
+    axis = np.abs(components).argmax(axis=0)
+    face = np.where(components[axis, np.arange(len(x))] < 0, axis + 3, axis)
+    u, v = np.empty_like(x), np.empty_like(x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for face_id, (u_face, v_face) in enumerate(
+            [(y / x, z / x), (-x / y, z / y), (-x / z, -y / z), (z / x, y / x), (z / y, -x / y), (-y / z, -x / z)]
+        ):
+            on_face = face == face_id
+            u[on_face], v[on_face] = u_face[on_face], v_face[on_face]
+    return face, u, v
+
+
+def _s2_st_from_uv(uv: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore"):
+        return np.where(uv >= 0, 0.5 * np.sqrt(1 + 3 * uv), 1 - 0.5 * np.sqrt(1 - 3 * uv))
+
+
+def _s2_uv_from_st(st: np.ndarray) -> np.ndarray:
+    return np.where(st >= 0.5, (1 / 3.0) * (4 * st * st - 1), (1 / 3.0) * (1 - 4 * (1 - st) * (1 - st)))
+
+
+def _s2_ij_from_st(st: np.ndarray) -> np.ndarray:
+    max_size = 1 << S2_MAX_LEVEL
+    return np.clip(np.floor(max_size * st), 0, max_size - 1).astype(np.uint64)
+
+
+def cellids_from_coords(lats: Sequence[float], lngs: Sequence[float], level: int) -> np.ndarray:
+    """Computes the S2CellIds of many coordinates at once, without going
+    through S2RegionCoverer.
+    Arguments:
+      lats: Latitudes in degrees.
+      lngs: Longitudes in degrees.
+      level: The S2Cell level of the returned ids.
+    Returns:
+      An int64 array with the ids of the cells containing the coordinates.
+      Ids of faces 4 and 5 do not fit an int64 and are stored as their two's
+      complement (negative) value, view the array as uint64 to recover them.
+    """
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lngs = np.radians(np.asarray(lngs, dtype=float))
+    x, y, z = np.cos(lats) * np.cos(lngs), np.cos(lats) * np.sin(lngs), np.sin(lats)
+    face, u, v = _s2_face_uv_from_xyz(x, y, z)
+    i, j = _s2_ij_from_st(_s2_st_from_uv(u)), _s2_ij_from_st(_s2_st_from_uv(v))
+
+    face = face.astype(np.uint64)
+    cellids = face << np.uint64(60)
+    bits = face & np.uint64(S2_SWAP_MASK)
+    mask = np.uint64((1 << S2_LOOKUP_BITS) - 1)
+    for k in range(7, -1, -1):
+        offset = np.uint64(k * S2_LOOKUP_BITS)
+        bits = bits + (((i >> offset) & mask) << np.uint64(S2_LOOKUP_BITS + 2))
+        bits = bits + (((j >> offset) & mask) << np.uint64(2))
+        bits = _S2_LOOKUP_POS[bits.astype(np.intp)]
+        cellids |= (bits >> np.uint64(2)) << np.uint64(2 * k * S2_LOOKUP_BITS)
+        bits &= np.uint64(S2_SWAP_MASK | S2_INVERT_MASK)
+    cellids = cellids * np.uint64(2) + np.uint64(1)
+
+    lsb = np.uint64(1 << (2 * (S2_MAX_LEVEL - level)))
+    cellids = (cellids & ~(lsb - np.uint64(1))) | lsb
+    return cellids.view(np.int64)
+
+
+def _s2_face_ij_from_cellids(cellids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Decodes the face and the (i, j) leaf coordinates of uint64 S2CellIds."""
+    face = cellids >> np.uint64(61)
+    i, j = np.zeros_like(cellids), np.zeros_like(cellids)
+    bits = face & np.uint64(S2_SWAP_MASK)
+    for k in range(7, -1, -1):
+        n_bits = S2_MAX_LEVEL - 7 * S2_LOOKUP_BITS if k == 7 else S2_LOOKUP_BITS
+        bits = bits + (
+            ((cellids >> np.uint64(k * 2 * S2_LOOKUP_BITS + 1)) & np.uint64((1 << (2 * n_bits)) - 1)) << np.uint64(2)
+        )
+        bits = _S2_LOOKUP_IJ[bits.astype(np.intp)]
+        i += (bits >> np.uint64(S2_LOOKUP_BITS + 2)) << np.uint64(k * S2_LOOKUP_BITS)
+        j += ((bits >> np.uint64(2)) & np.uint64((1 << S2_LOOKUP_BITS) - 1)) << np.uint64(k * S2_LOOKUP_BITS)
+        bits &= np.uint64(S2_SWAP_MASK | S2_INVERT_MASK)
+    return face, i, j
+
+
+def _s2_latlng_from_face_uv(face: np.ndarray, u: np.ndarray, v: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    ones = np.ones_like(u)
+    xyz_by_face = [(ones, u, v), (-u, ones, v), (-u, -v, ones), (-ones, -v, -u), (v, -ones, -u), (v, u, -ones)]
+    x, y, z = np.empty_like(u), np.empty_like(u), np.empty_like(u)
+    for face_id, (x_face, y_face, z_face) in enumerate(xyz_by_face):
+        on_face = face == face_id
+        x[on_face], y[on_face], z[on_face] = x_face[on_face], y_face[on_face], z_face[on_face]
+    lats = np.degrees(np.arctan2(z, np.sqrt(x * x + y * y)))
+    lngs = np.degrees(np.arctan2(y, x))
+    return lats, lngs
+
+
+def coords_from_cellids(cellids: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Computes the center coordinates of many S2CellIds at once.
+    Arguments:
+      cellids: S2CellIds, as returned by cellids_from_coords.
+    Returns:
+      The latitudes and longitudes (degrees) of the cell centers.
+    """
+    cellids = np.asarray(cellids).astype(np.int64).view(np.uint64)
+    face, i, j = _s2_face_ij_from_cellids(cellids)
+
+    is_leaf = (cellids & np.uint64(1)) == 1
+    delta = np.where(is_leaf, 1, np.where(((i ^ (cellids >> np.uint64(2))) & np.uint64(1)) == 1, 2, 0))
+    u = _s2_uv_from_st(((i << np.uint64(1)).astype(float) + delta) / (1 << (S2_MAX_LEVEL + 1)))
+    v = _s2_uv_from_st(((j << np.uint64(1)).astype(float) + delta) / (1 << (S2_MAX_LEVEL + 1)))
+    return _s2_latlng_from_face_uv(face, u, v)
+
+
+def cell_boundaries_from_cellids(cellids: Sequence[int], points_per_edge: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+    """Computes the boundaries of many S2Cells at once, as rings of points on the cell edges.
+    The edges are geodesics, so they are curved in lng-lat: more points per edge follow them
+    more closely.
+    Arguments:
+      cellids: S2CellIds, as returned by cellids_from_coords.
+      points_per_edge: The number of points of every edge, starting at its first vertex.
+    Returns:
+      The latitudes and longitudes (degrees) of the rings, counterclockwise, both of shape
+      (len(cellids), 4 * points_per_edge).
+    """
+    cellids = np.asarray(cellids).astype(np.int64).view(np.uint64)
+    face, i, j = _s2_face_ij_from_cellids(cellids)
+
+    # The lowest set bit is 4 ** (S2_MAX_LEVEL - level), the cell spans 2 ** (S2_MAX_LEVEL - level) leaves.
+    lsb = cellids & (~cellids + np.uint64(1))
+    size = np.sqrt(lsb.astype(float)).astype(np.uint64)
+    i, j = i & ~(size - np.uint64(1)), j & ~(size - np.uint64(1))
+
+    steps = np.arange(points_per_edge) / points_per_edge
+    zeros, ones = np.zeros(points_per_edge), np.ones(points_per_edge)
+    di = np.concatenate([steps, ones, 1 - steps, zeros])
+    dj = np.concatenate([zeros, steps, ones, 1 - steps])
+    size = size.astype(float)[:, None]
+    s = (i.astype(float)[:, None] + di * size) / (1 << S2_MAX_LEVEL)
+    t = (j.astype(float)[:, None] + dj * size) / (1 << S2_MAX_LEVEL)
+    lats, lngs = _s2_latlng_from_face_uv(np.repeat(face, len(di)), _s2_uv_from_st(s).ravel(), _s2_uv_from_st(t).ravel())
+    return lats.reshape(s.shape), lngs.reshape(s.shape)
+
+
+def cellids_from_points(points: Sequence[Point], level: int) -> np.ndarray:
+    """Computes the S2CellIds of many Shapely Points at once.
+    Arguments:
+      points: The lng-lat points (e.g. a GeoSeries).
+      level: The S2Cell level of the returned ids.
+    Returns:
+      An int64 array of cell ids, see cellids_from_coords.
+    """
+    coords = np.array([(point.y, point.x) for point in points], dtype=float).reshape(-1, 2)
+    return cellids_from_coords(coords[:, 0], coords[:, 1], level)
+
+
 def cellids_from_s2cellids(list_s2cells: Sequence[s2.S2CellId]) -> Sequence[int]:
     """Converts a sequence of S2CellIds to a sequence of ids of the S2CellIds.
     Arguments:
@@ -314,9 +607,7 @@ def s2cellids_from_point(point: Point, level: int) -> Sequence[s2.S2CellId]:
       A sequence of S2Cells that cover the provided Shapely Point.
     """
 
-    s2polygon = s2polygon_from_shapely_point(point)
-    cellid = get_s2cover_for_s2polygon(s2polygon, level)[0]
-    return [cellid]
+    return [s2.S2CellId(cellid_from_point(point, level))]
 
 
 def cellid_from_point(point: Point, level: int) -> int:
@@ -329,12 +620,7 @@ def cellid_from_point(point: Point, level: int) -> int:
     """
 
     assert isinstance(point, Point), f"Object not a Shapely Point but a type {type(point)}"
-    s2polygon = s2polygon_from_shapely_point(point)
-    cellids = get_s2cover_for_s2polygon(s2polygon, level)
-    if cellids is None:
-        sys.exit("S2cellid covering failed because the point is a None.")
-    cellid = cellids[0]
-    return cellid.id()
+    return int(cellids_from_coords([point.y], [point.x], level).view(np.uint64)[0])
 
 
 def s2cellids_from_polygon(polygon: Polygon, level: int) -> Optional[Sequence]:
@@ -388,8 +674,7 @@ def get_bearing(start: Point, goal: Point) -> float:
       bearing angle given by azi1 (azimuth) is clockwise relative to north, so
       a bearing of 90 degrees is due east, 180 is south, and 270 is west.
     """
-    solution = geographiclib.geodesic.Geodesic.WGS84.Inverse(start.y, start.x, goal.y, goal.x)
-    return solution["azi1"] % 360
+    return float(geodesic_bearings(start.y, start.x, goal.y, goal.x))
 
 
 def get_distance_km(start: Point, goal: Point) -> float:
@@ -397,7 +682,7 @@ def get_distance_km(start: Point, goal: Point) -> float:
     This distance is direct (as the bird flies), rather than based on a route
     going over roads and around buildings.
     """
-    return geodesic(start.coords, goal.coords).km
+    return float(geodesic_distances(start.y, start.x, goal.y, goal.x)) / 1000
 
 
 def concat_numbers(n_1: int, n_2: int) -> int:
@@ -416,7 +701,7 @@ def get_distance_m(start: Point, goal: Point) -> float:
     This distance is direct (as the bird flies), rather than based on a route
     going over roads and around buildings.
     """
-    return geodesic(start.coords, goal.coords).m
+    return float(geodesic_distances(start.y, start.x, goal.y, goal.x))
 
 
 def tuple_from_point(point: Point) -> CoordsYX:
@@ -502,19 +787,16 @@ def get_distance_between_point_to_geometry(geometry: BaseGeometry, point: Point)
     Returns:
       The distance between point and polygon in meters.
     """
-    dist_min = float("Inf")
     if isinstance(geometry, MultiPolygon):
-        coords = [coord for poly in geometry for coord in poly.exterior.coords]
+        coords = [coord for poly in geometry.geoms for coord in poly.exterior.coords]
     elif isinstance(geometry, Polygon):
         coords = geometry.exterior.coords
     else:
         coords = geometry.coords
-    for coord in coords:
-        point_current = Point(coord)
-        dist = get_distance_between_points(point, point_current)
-        if dist_min > dist:
-            dist_min = dist
-    return dist_min
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if not len(coords):
+        return float("Inf")
+    return float(haversine_distances(point.y, point.x, coords[:, 1], coords[:, 0]).min())
 
 
 def get_line_length(line: LineString) -> float:
@@ -524,14 +806,7 @@ def get_line_length(line: LineString) -> float:
     Returns:
       The length of the line in meters
     """
-    dist = 0
-    point_1 = Point(line.coords[0])
-    for coord in line.coords[1:]:
-        point_2 = Point(coord)
-        dist += get_distance_between_points(point_1, point_2)
-        point_1 = point_2
-
-    return dist
+    return polyline_length(line.coords)
 
 
 def point_from_list_coord_yx(coord: Sequence) -> Point:
@@ -624,13 +899,8 @@ def get_centers_from_s2cellids(s2cell_ids: Sequence[int64]) -> Sequence[Point]:
     Returns:
       a list of shapely points of shape the size of the cellids list.
     """
-    prediction_coords = []
-    for s2cellid in s2cell_ids:
-        s2_latlng = s2.S2CellId(int(s2cellid)).ToLatLng()
-        lat = s2_latlng.lat().degrees()
-        lng = s2_latlng.lng().degrees()
-        prediction_coords.append(Point(lng, lat))
-    return prediction_coords
+    lats, lngs = coords_from_cellids(np.asarray([int(cellid) for cellid in s2cell_ids], dtype=np.uint64))
+    return [Point(lng, lat) for lat, lng in zip(lats, lngs)]
 
 
 def get_center_from_s2cellids(s2cell_ids: Sequence[int64]) -> Sequence[CoordsYX]:
@@ -640,13 +910,8 @@ def get_center_from_s2cellids(s2cell_ids: Sequence[int64]) -> Sequence[CoordsYX]
     Returns:
       a list of shapely points of shape the size of the cellids list.
     """
-    prediction_coords = []
-    for s2cellid in s2cell_ids:
-        s2_latlng = s2.S2CellId(int(s2cellid)).ToLatLng()
-        lat = s2_latlng.lat().degrees()
-        lng = s2_latlng.lng().degrees()
-        prediction_coords.append([lat, lng])
-    return np.array(prediction_coords)
+    lats, lngs = coords_from_cellids(np.asarray([int(cellid) for cellid in s2cell_ids], dtype=np.uint64))
+    return np.stack([lats, lngs], axis=-1).reshape(-1, 2)
 
 
 def get_linestring_distance(line: LineString) -> int:
@@ -656,14 +921,7 @@ def get_linestring_distance(line: LineString) -> int:
     Returns:
       Line length in meters.
     """
-    dist = 0
-    point_1 = Point(line.coords[0])
-    for coord in line.coords[1:]:
-        point_2 = Point(coord)
-        dist += get_distance_between_points(point_1, point_2)
-        point_1 = point_2
-
-    return dist
+    return polyline_length(line.coords)
 
 
 def get_distance_between_points(point_1: Point, point_2: Point) -> int:
@@ -675,7 +933,7 @@ def get_distance_between_points(point_1: Point, point_2: Point) -> int:
       Distance length in meters.
     """
 
-    dist = ox.distance.great_circle_vec(point_1.y, point_1.x, point_2.y, point_2.x)
+    dist = float(haversine_distances(point_1.y, point_1.x, point_2.y, point_2.x))
 
     assert dist >= 0
     return dist
@@ -1,96 +1,187 @@
+import collections
 import multiprocessing
-from typing import Optional
+from typing import Iterator, List, Optional, Sequence
 
-from geojson_pydantic import Point
+import geopandas as gpd
 
 from HeGel2 import settings
-from HeGel2.geo.db.mongo import insert_document
+from HeGel2.geo.db.journal import ChunkRange, ProgressJournal, chunk_range
+from HeGel2.geo.db.mongo import Document, DocumentSink, FlushStats
 from HeGel2.geo.extractors.extractor import GeoFeatures
+from HeGel2.geo.extractors.plan import FeaturePlan
 from HeGel2.geo.map_processor import regions
+from HeGel2.geo.map_processor.bundle import Filters
 from HeGel2.geo.map_processor.map import Map
 from HeGel2.geo.models.get_feature import PoiData
 
 
-def create_osm_graph(region: str, map_data_dir: Optional[str], s2_level: int = settings.S2_LEVEL) -> Map:
+def create_osm_graph(
+    region: str, map_data_dir: Optional[str], s2_level: int = settings.S2_LEVEL, osm_file: Optional[str] = None
+) -> Map:
     return (
-        Map(regions.get_region(region), s2_level, map_data_dir)
+        Map(regions.get_region(region), s2_level, map_data_dir, osm_file=osm_file)
         if map_data_dir is not None
-        else (Map(regions.get_region(region), s2_level))
+        else (Map(regions.get_region(region), s2_level, osm_file=osm_file))
     )
 
 
+# The run whose map and indexes are inherited by the pool workers when they are forked.
+_RUN: Optional["BaseRun"] = None
+
+
+def _extract_chunk(poi: gpd.GeoDataFrame) -> List[Document]:
+    return _RUN.extract_chunk(poi)
+
+
+class _Checkpoints:
+    """
+    Marks the chunks written to a sink completed in the journal, once the sink flushed all their documents
+    """
+
+    def __init__(self, sink: DocumentSink, journal: Optional[ProgressJournal]):
+        self.sink = sink
+        self.journal = journal
+        self.written = sink.flushed + sink.pending
+        # (documents written up to the end of the chunk, chunk), in the order of writing.
+        self.unflushed = collections.deque()
+
+    def write(self, documents: List[Document], chunk: ChunkRange):
+        self.sink.write_many(documents)
+        self.written += len(documents)
+        self.unflushed.append((self.written, chunk))
+        self.commit()
+
+    def commit(self):
+        flushed = []
+        while self.unflushed and self.unflushed[0][0] <= self.sink.flushed:
+            flushed.append(self.unflushed.popleft()[1])
+        if flushed and self.journal is not None:
+            self.journal.mark_completed(flushed)
+
+
 class BaseRun:
-    def __init__(self, map: Map):
+    def __init__(
+        self,
+        map: Map,
+        where: Optional[Filters] = None,
+        fields: Optional[Sequence[str]] = None,
+        nearest: bool = True,
+        random_state: Optional[int] = None,
+    ):
+        """
+        Arguments:
+          map: The map whose POI are extracted.
+          where: Only extract the POI that match these filters (see Map.iter_poi).
+          fields: Only extract these fields of PoiData (by alias, osmid is always extracted), all of them if None.
+          nearest: Whether the nearby landmarks are the nearest ones, else a sample seeded by random_state.
+          With the defaults, every run writes the same documents for the same map.
+          random_state: The seed of the landmark sample when nearest is False.
+        """
         self.map = map
-        self.map_nodes = map.poi
+        self.where = where
+        self.fields = None if fields is None else ["osmid", *fields]
+        self.plan = FeaturePlan(self.fields, nearest, random_state)
         self.geo_features = GeoFeatures("Tel_Aviv", map)
 
-    def run_extractors(self, row, sema, return_dict):
-        name = row["name"] if row["name"] else row["wikipedia"]
-        amenity = row.get("amenity") or row.get("tourism") or row.get("building") or row.get("description")
-        geometry = row["centroid"]
-        osmid = str(row["osmid"])
-        street_names = self.geo_features.get_streets(osmid)
-        print(street_names)
-        is_junction = self.geo_features.is_poi_in_junction(osmid)
-        lat, lon = geometry.x, geometry.y
-        no_primery_nearby_streets = self.geo_features.get_nearby_streets(lat, lon, is_primery=False)
-        primery_nearby_streets = self.geo_features.get_nearby_streets(lat, lon, is_primery=True)
-        relation = self.geo_features.get_relation_in_street(osmid, geometry)
-        distance, bearing = self.geo_features.get_distance_from_city_center(geometry)
-        neighbourhood = self.geo_features.get_neighborhood(geometry)
-        nearby_landmarks = self.geo_features.get_top_k_nearest_landmarks(point=geometry)
-
-        doc = PoiData(
-            osmid=osmid,
-            name=name,
-            amenity=amenity,
-            location=Point(coordinates=[geometry.x, geometry.y]),
-            is_junction=is_junction,
-            street_names=street_names,
-            nearby_to_non_primery_streets=no_primery_nearby_streets,
-            nearby_to_primery_streets=primery_nearby_streets,
-            relation_in_street=relation,
-            neighbourhood=neighbourhood,
-            cardinal_direction_to_city_center=bearing,
-            distance_from_city_center=distance,
-            nearby_landmarks=nearby_landmarks,
-        )
-
-        print(doc)
-        insert_document(doc)
-
-    def process_batch(self, batch):
-        with multiprocessing.Pool(multiprocessing.cpu_count() - 1) as pool:
-            results = pool.map(self.run_extractors, batch.to_dict(orient="records"))
-        return results
+    def run_extractors(self, row) -> PoiData:
+        """
+        Extracts the features of a single POI row
+        """
+        poi = gpd.GeoDataFrame([row], columns=row.index)
+        return GeoFeatures.to_poi_data(self.plan.run(self.geo_features, poi))[0]
+
+    def extract_chunk(self, poi: gpd.GeoDataFrame) -> List[Document]:
+        """
+        Extracts the documents of a chunk of POI rows
+        """
+        features = self.plan.run(self.geo_features, poi)
+        return [doc.dict(by_alias=True, exclude_unset=True) for doc in GeoFeatures.to_poi_data(features)]
 
     @staticmethod
     def _process_map_nodes(map: Map):
         map_without_osmid_col = map.nodes.drop("osmid", axis=1)
         return map_without_osmid_col.reset_index()
 
-    def run(self):
-        manager = multiprocessing.Manager()
-        sema = multiprocessing.Semaphore(settings.N_CPU)
-
-        # if macos or windows - need to use 'fork'
-        multiprocessing.set_start_method("fork", force=True)
-
-        # 2. Extract geo features from POI-s
-        for i in range(0, settings.NUMBER_OF_DOCUMENTS, settings.BATCH_SIZE):
-            batch = self.map_nodes.iloc[i: i + settings.BATCH_SIZE]
-            return_dict = manager.dict()
-            jobs = []
-            for j in batch.iterrows():
-                p = multiprocessing.Process(target=self.run_extractors, args=(j[1], sema, return_dict))
-                jobs.append(p)
-                p.start()
+    def chunks(self) -> Iterator[gpd.GeoDataFrame]:
+        """
+        Streams the first NUMBER_OF_DOCUMENTS POI that match where, in chunks of BATCH_SIZE
+        """
+        remaining = settings.NUMBER_OF_DOCUMENTS
+        for chunk in self.map.iter_poi(settings.BATCH_SIZE, where=self.where):
+            if remaining <= 0:
+                break
+            yield chunk.iloc[:remaining]
+            remaining -= len(chunk)
+
+    def open_journal(self) -> Optional[ProgressJournal]:
+        """
+        Opens the progress journal of this run (region, map version and plan), None if PROGRESS_JOURNAL
+        is None or the map has no bundle to version it by
+        """
+        map_version = self.map.version()
+        if settings.PROGRESS_JOURNAL is None or map_version is None:
+            return None
+        return ProgressJournal(self.map.map_name, map_version, self.plan.key, settings.PROGRESS_JOURNAL)
+
+    def run(
+        self,
+        sink: Optional[DocumentSink] = None,
+        max_in_flight: Optional[int] = None,
+        journal: Optional[ProgressJournal] = None,
+    ) -> List[FlushStats]:
+        """
+        Extracts the documents of the first NUMBER_OF_DOCUMENTS POI in a pool of N_CPU forked workers.
+        The workers inherit the map and the indexes at fork. The POI chunks are streamed from the map
+        to the workers with at most max_in_flight chunks (2 per worker by default) read but not yet
+        written, so memory is bounded by the chunks in flight and not by the number of POI. The
+        documents are written to the sink in the order of the chunks. When only some fields are extracted,
+        the default sink merges them into the stored documents.
+        A chunk is recorded in the progress journal (open_journal by default) once its documents are
+        flushed, and the chunks recorded by earlier runs are skipped, so a restarted run resumes.
+        """
+        global _RUN
+        sink = sink if sink is not None else DocumentSink(merge=self.fields is not None)
+        max_in_flight = max_in_flight or 2 * settings.N_CPU
+
+        # fork explicitly (the default on macOS and windows is spawn) so the workers share the map.
+        _RUN = self
+        self.plan.prepare(self.geo_features)
+        own_journal = journal is None
+        try:
+            with multiprocessing.get_context("fork").Pool(settings.N_CPU) as pool:
+                # Opened after the fork, so the workers don't inherit the sqlite connection of the journal.
+                journal = self.open_journal() if own_journal else journal
+                self._extract_chunks(pool, sink, journal, max_in_flight)
+                pool.close()
+                pool.join()
+        finally:
+            _RUN = None
+            if own_journal and journal is not None:
+                journal.close()
+        return sink.stats
+
+    def _extract_chunks(self, pool, sink: DocumentSink, journal: Optional[ProgressJournal], max_in_flight: int) -> None:
+        completed = journal.completed() if journal is not None else set()
+        checkpoints = _Checkpoints(sink, journal)
+        in_flight = collections.deque()
+        for chunk in self.chunks():
+            chunk_id = chunk_range(chunk)
+            if chunk_id in completed:
+                continue
+            if len(in_flight) >= max_in_flight:
+                result, written_id = in_flight.popleft()
+                checkpoints.write(result.get(), written_id)
+            in_flight.append((pool.apply_async(_extract_chunk, (chunk,)), chunk_id))
+        while in_flight:
+            result, written_id = in_flight.popleft()
+            checkpoints.write(result.get(), written_id)
+        sink.flush()
+        checkpoints.commit()
 
 
 def main():
     # 1. Create Map Object
-    map = Map(regions.get_region("TelAvivSmall"), 14, settings.MAP_DIR)
+    map = Map(regions.get_region("TelAvivSmall"), 14, settings.MAP_DIR, osm_file=settings.OSM_FILE)
     # map.is_graph_available()
     # out_map.write_map('/Users/itaimondshine/PycharmProjects/NLP/toolbox')
 
@@ -1,12 +1,25 @@
 import multiprocessing
+import os
 
 BATCH_SIZE = 50
 REGION = "Tel Aviv"
 MAP_DIR = "/Users/itaimondshine/PycharmProjects/NLP/HeGel2/HeGel2/HeGel2/geo/map_processor/resources/tel_aviv/"
 NEIGHBORHOODS_LIBRARY = "HeGel2/geo/extractors/city_polygons/"
 MAP_DATA_DIR = f"{MAP_DIR}/{REGION}_paths.gpkg"
+# A local OSM extract (.osm, .osm.bz2 or .osm.pbf) to build maps from instead of the Overpass API.
+OSM_FILE = None
+OSM_CACHE_DIR = os.path.expanduser("~/.cache/hegel2/osm")
+OSM_CACHE_MAX_BYTES = 2 * 2**30
+# The sqlite journal of the chunks each extraction run completed, None to always extract everything.
+PROGRESS_JOURNAL = os.path.expanduser("~/.cache/hegel2/progress.sqlite")
 
 S2_LEVEL = 14
-N_CPU = multiprocessing.cpu_count() - 1
+N_CPU = max(1, multiprocessing.cpu_count() - 1)
 LANDMARKS_DISTANCE = 500
 NUMBER_OF_DOCUMENTS = 50
+
+MONGO_URI = "mongodb://localhost:27017/"
+MONGO_DATABASE = "hegel"
+MONGO_COLLECTION = "TelAviv"
+MONGO_BATCH_SIZE = 500
+MONGO_FLUSH_INTERVAL = 5.0
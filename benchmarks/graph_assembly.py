@@ -0,0 +1,94 @@
+"""Throughput of Map._save_to_graph on synthetic, osmnx-shaped node and edge frames.
+
+Usage:
+  python3 -m benchmarks.graph_assembly [--sizes 100000 1000000] [--baseline]
+
+--baseline also times the previous row-by-row (iterrows) assembly, which is
+only practical for the smaller sizes.
+"""
+
+import argparse
+import time
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+from shapely.geometry import LineString
+
+from HeGel2.geo.map_processor.map import Map
+
+HIGHWAYS = np.array(["residential", "primary", "secondary", "tertiary", "footway", "service"], dtype=object)
+
+
+def make_frames(n_edges: int, seed: int = 0):
+    """Returns (nodes, edges) frames with the columns build_graph hands to _save_to_graph."""
+    random = np.random.RandomState(seed)
+    n_nodes = max(2, int(n_edges * 0.7))
+    osmids = np.arange(n_nodes, dtype=np.int64) + 1_000_000
+    xs = 34.75 + random.random_sample(n_nodes) * 0.1
+    ys = 32.05 + random.random_sample(n_nodes) * 0.1
+    nodes = gpd.GeoDataFrame(
+        {"osmid": osmids, "y": ys, "x": xs, "street_count": random.randint(1, 5, n_nodes), "highway": None},
+        geometry=gpd.points_from_xy(xs, ys),
+        crs="EPSG:4326",
+    )
+
+    u = random.randint(0, n_nodes, n_edges)
+    v = random.randint(0, n_nodes, n_edges)
+    names = np.array([f"street {i}" for i in range(max(1, n_edges // 20))], dtype=object)
+    edges = gpd.GeoDataFrame(
+        {
+            "u": osmids[u],
+            "v": osmids[v],
+            "key": np.zeros(n_edges, dtype=np.int64),
+            "osmid": np.arange(n_edges, dtype=np.int64),
+            "name": names[random.randint(0, len(names), n_edges)],
+            "highway": HIGHWAYS[random.randint(0, len(HIGHWAYS), n_edges)],
+            "oneway": random.random_sample(n_edges) < 0.3,
+            "length": random.random_sample(n_edges) * 200,
+        },
+        geometry=[LineString([(xs[a], ys[a]), (xs[b], ys[b])]) for a, b in zip(u, v)],
+        crs="EPSG:4326",
+    )
+    return nodes, edges
+
+
+def iterrows_assembly(nodes_gdf, edges_gdf):
+    """The previous implementation of _save_to_graph, kept as the baseline."""
+    graph = nx.MultiGraph()
+    nodes_gdf = nodes_gdf.drop_duplicates(subset=["osmid"])
+    node_data = nodes_gdf.set_index("osmid").to_dict("index")
+    graph.add_nodes_from(node_data.keys())
+    for node_id, node_attrs in node_data.items():
+        graph.nodes[node_id].update(node_attrs)
+    for _, row in edges_gdf.iterrows():
+        edge_attrs = {key: row[key] for key in row.index if key not in ["from", "to", "key"]}
+        graph.add_edge(row["u"], row["v"], key=row["key"], **edge_attrs)
+    return graph
+
+
+def timed(function, nodes, edges) -> float:
+    start = time.perf_counter()
+    function(nodes, edges)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--baseline", action="store_true", help="Also time the iterrows assembly.")
+    args = parser.parse_args()
+
+    print(f"{'edges':>10} {'assembly':>10} {'seconds':>9} {'edges/sec':>12}")
+    for size in args.sizes:
+        nodes, edges = make_frames(size)
+        runs = [("columnar", Map._save_to_graph)]
+        if args.baseline:
+            runs.append(("iterrows", iterrows_assembly))
+        for label, function in runs:
+            seconds = timed(function, nodes, edges)
+            print(f"{size:>10,} {label:>10} {seconds:>9.2f} {size / seconds:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""A small map built in memory (no network), to write and open as a bundle."""
+
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import LineString, Point, box
+
+from HeGel2.geo.map_processor import regions
+
+REGION = regions.Region(name="Test", polygon=box(34.76, 32.06, 34.80, 32.09))
+
+# Two neighbourhoods side by side, and a POI in the middle of each.
+NEIGHBORHOODS = gpd.GeoDataFrame(
+    {"name": ["West", "East"]}, geometry=[box(34.77, 32.07, 34.78, 32.08), box(34.78, 32.07, 34.79, 32.08)], crs=4326
+)
+POI_POINTS = [Point(34.775, 32.075), Point(34.785, 32.075)]
+# The corners of a square block of streets around the first POI.
+CORNERS = {3: (34.772, 32.072), 4: (34.778, 32.072), 5: (34.778, 32.078), 6: (34.772, 32.078)}
+
+
+def small_map(level: int = 14):
+    """
+    A map of two POI joined by one street, the first inside a block of four streets, at the given S2Cell level
+    """
+    from HeGel2.geo.map_processor.map import Map
+
+    map = Map.__new__(Map)
+    map._set_region(REGION, level, None, None)
+    map.poi = gpd.GeoDataFrame(
+        {"osmid": [1, 2], "name": ["cafe", "bar"], "amenity": ["cafe", "bar"], "centroid": POI_POINTS},
+        geometry=POI_POINTS,
+        crs=4326,
+    )
+    coords = {1: (POI_POINTS[0].x, POI_POINTS[0].y), 2: (POI_POINTS[1].x, POI_POINTS[1].y), **CORNERS}
+    ends = [(1, 2), (3, 4), (4, 5), (5, 6), (6, 3)]
+    map.streets = gpd.GeoDataFrame(
+        {
+            "u": [u for u, _ in ends],
+            "v": [v for _, v in ends],
+            "key": 0,
+            "name": ["Main", "South", "East", "North", "West"],
+            "highway": ["residential", "primary", "residential", "primary", "residential"],
+        },
+        geometry=[LineString([coords[u], coords[v]]) for u, v in ends],
+        index=pd.Index(range(101, 101 + len(ends)), name="osmid"),
+        crs=4326,
+    )
+    map.nodes = gpd.GeoDataFrame(
+        {"osmid": list(coords), "x": [x for x, _ in coords.values()], "y": [y for _, y in coords.values()]},
+        geometry=[Point(xy) for xy in coords.values()],
+        crs=4326,
+    ).set_index("osmid", drop=False)
+    map.edges = map.streets.copy()
+    map.city_polygons = NEIGHBORHOODS
+    return map
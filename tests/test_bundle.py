@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from HeGel2.geo.map_processor import bundle
+
+NEGLIGIBLE = ["bench", "waste_basket"]
+
+
+@pytest.fixture
+def poi_layer(tmp_path):
+    frame = pd.DataFrame(
+        {
+            "osmid": np.arange(8),
+            "amenity": ["cafe", None, "bench", "bar", None, "waste_basket", "school", None],
+        }
+    )
+    entry = bundle.write_layer(frame, str(tmp_path / "poi.parquet"))
+    return frame, str(tmp_path), entry
+
+
+@pytest.mark.parametrize(
+    "filters, expected",
+    [
+        ([("amenity", "not in", NEGLIGIBLE)], [0, 3, 6]),
+        ([("amenity", "!=", "bench")], [0, 3, 5, 6]),
+        ([("amenity", "in", ["cafe", "bar", "school", "bench"])], [0, 2, 3, 6]),
+    ],
+)
+def test_null_never_matches(poi_layer, filters, expected):
+    frame, dir_name, entry = poi_layer
+    assert bundle.read_layer(dir_name, entry, filters=filters)["osmid"].tolist() == expected
+    assert pd.concat(bundle.iter_layer(dir_name, entry, 3, filters=filters))["osmid"].tolist() == expected
+    assert frame["osmid"][bundle.filter_mask(frame, filters)].tolist() == expected
+
+
+def test_null_columns_of_other_conjunctions_match(poi_layer):
+    frame, dir_name, entry = poi_layer
+    filters = [[("amenity", "not in", NEGLIGIBLE)], [("osmid", "==", 4)]]
+    assert bundle.read_layer(dir_name, entry, filters=filters)["osmid"].tolist() == [0, 3, 4, 6]
+    assert frame["osmid"][bundle.filter_mask(frame, filters)].tolist() == [0, 3, 4, 6]
@@ -0,0 +1,50 @@
+import geopandas as gpd
+import pytest
+from shapely.geometry import Point
+
+pytest.importorskip("s2geometry")
+
+from HeGel2.geo.extractors.extractor import GeoFeatures  # noqa: E402
+from HeGel2.geo.extractors.indexes import LandmarkIndex  # noqa: E402
+
+from .maps import small_map  # noqa: E402
+
+# Three landmarks on a line, about 50 meters apart.
+LANDMARK_POINTS = [Point(34.7750, 32.075), Point(34.7755, 32.075), Point(34.7760, 32.075)]
+
+
+@pytest.fixture
+def landmarks():
+    poi = gpd.GeoDataFrame(
+        {
+            "osmid": [1, 2, 3],
+            "name": ["Cafe", "Bar", "Bank"],
+            "amenity": ["cafe", "bar", "bank"],
+            "centroid": LANDMARK_POINTS,
+        },
+        geometry=LANDMARK_POINTS,
+        crs=4326,
+    )
+    return LandmarkIndex(poi, 500)
+
+
+def test_top_k_excludes_the_poi_itself(landmarks):
+    x, y = LANDMARK_POINTS[0].x, LANDMARK_POINTS[0].y
+
+    assert [name for name, _, _ in landmarks.top_k(x, y, 5)] == ["Cafe", "Bar", "Bank"]
+    assert [name for name, _, _ in landmarks.top_k(x, y, 5, exclude="1")] == ["Bar", "Bank"]
+
+
+def test_top_k_bulk_excludes_every_poi_itself(landmarks):
+    xs, ys = [p.x for p in LANDMARK_POINTS], [p.y for p in LANDMARK_POINTS]
+
+    nearby = landmarks.top_k_bulk(xs, ys, 1, excludes=["1", "2", "3"])
+    assert [[name for name, _, _ in selected] for selected in nearby] == [["Bar"], ["Cafe"], ["Bar"]]
+
+
+def test_nearby_landmarks_of_a_lone_poi_are_empty():
+    map = small_map()
+
+    # The two POI of the map are farther apart than LANDMARKS_DISTANCE, so each has only itself around.
+    features = GeoFeatures("Test", map).extract_batch(map.poi, fields=["osmid", "nearby_landmarks"])
+    assert features["nearby_landmarks"].tolist() == [[], []]
@@ -0,0 +1,70 @@
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("s2geometry")
+
+from HeGel2.geo.extractors.extractor import GeoFeatures  # noqa: E402
+from HeGel2.geo.map_processor import blocks  # noqa: E402
+from HeGel2.geo.map_processor.map import Map  # noqa: E402
+
+from .maps import NEIGHBORHOODS, POI_POINTS, REGION, small_map  # noqa: E402
+
+
+def _neighborhoods(map):
+    return GeoFeatures("Test", map).get_neighborhoods_at([p.x for p in POI_POINTS], [p.y for p in POI_POINTS])
+
+
+@pytest.fixture
+def bundle_dir(tmp_path):
+    small_map(level=14).write_map(str(tmp_path), write_neighborhood_cells=True)
+    return str(tmp_path)
+
+
+def test_neighborhood_cells_opened_at_another_level(bundle_dir):
+    opened = Map(REGION, 18, bundle_dir)
+    opened.city_polygons = NEIGHBORHOODS
+
+    assert opened.get_neighborhood_cells().level == 18
+    assert _neighborhoods(opened) == ["West", "East"]
+
+
+def test_neighborhood_cells_read_at_the_build_level(bundle_dir):
+    opened = Map.open(bundle_dir, REGION)
+    opened.city_polygons = NEIGHBORHOODS
+
+    assert opened.get_neighborhood_cells().level == 14
+    assert opened.get_neighborhood_cells().to_frame().equals(small_map(level=14).get_neighborhood_cells().to_frame())
+    assert _neighborhoods(opened) == ["West", "East"]
+
+
+def test_neighborhood_cells_rebuilt_when_the_polygons_change(bundle_dir):
+    opened = Map.open(bundle_dir, REGION)
+    opened.city_polygons = NEIGHBORHOODS.iloc[::-1].reset_index(drop=True)
+
+    assert _neighborhoods(opened) == ["West", "East"]
+
+
+def _snapshot(dir_name):
+    return {path.name: path.read_bytes() for path in sorted(Path(dir_name).iterdir())}
+
+
+def test_getters_never_write_the_bundle(bundle_dir):
+    before = _snapshot(bundle_dir)
+    opened = Map(REGION, 18, bundle_dir)
+    opened.city_polygons = NEIGHBORHOODS
+
+    blocks_no_primery, _ = opened.get_street_blocks()
+    assert [sorted(names) for names in blocks_no_primery["names"]] == [["East", "North", "South", "West"]]
+    assert opened.get_neighborhood_cells().level == 18
+    assert _snapshot(bundle_dir) == before
+
+
+def test_street_blocks_read_once_written(bundle_dir, monkeypatch):
+    small_map(level=14).write_map(bundle_dir, write_street_blocks=True)
+    monkeypatch.setattr(blocks, "street_blocks", lambda streets: pytest.fail("the blocks were recomputed"))
+    opened = Map.open(bundle_dir, REGION)
+
+    blocks_no_primery, blocks_primery = opened.get_street_blocks()
+    assert [sorted(names) for names in blocks_no_primery["names"]] == [["East", "North", "South", "West"]]
+    assert len(blocks_primery) == 0